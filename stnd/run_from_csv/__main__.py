@@ -238,7 +238,9 @@ def main():
                         log_csv_for_concurrent
                     )
 
-                    concurrent_log_func(csv_path, shared_csv_updates)
+                    concurrent_log_func(
+                        csv_path, shared_csv_updates, verify=True
+                    )
 
                     log_file_path = args.log_file_path
                     optionally_make_parent_dir(log_file_path)
@@ -119,6 +119,8 @@ def prepare_config(config, sep="/"):
     for leaf_path, leaf_value in dict_leaves:
         if isinstance(leaf_value, str) and leaf_value[:5] == "copy@":
             path_to_copy_from = leaf_value.split("@")[-1].split(sep)
-            value_to_copy = get_nested_attr(config, path_to_copy_from)
+            value_to_copy = copy.deepcopy(
+                get_nested_attr(config, path_to_copy_from)
+            )
             set_nested_attr(new_config, leaf_path, value_to_copy)
     return new_config
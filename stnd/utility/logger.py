@@ -2,22 +2,16 @@ import os
 import shutil
 import sys
 import traceback
-import wandb
 import contextlib
 import time
-import subprocess
-import copy
-import gspread
-import pandas as pd
 import csv
 import re
 import warnings
 import logging
 import threading
-from pydrive2.auth import GoogleAuth, RefreshError
-from pydrive2.drive import GoogleDrive
-import psutil
-import multiprocessing as mp
+import itertools
+import io
+import weakref
 from tempfile import NamedTemporaryFile
 
 # Regex pattern to match ANSI escape sequences
@@ -28,12 +22,13 @@ ANSI_ESCAPE_PATTERN = re.compile(r"\x1b\[[0-9;]*m")
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 from stnd.utility.utils import (
     QUOTE_CHAR,
+    CSV_READ_BUFFER_SIZE,
     SYSTEM_PLATFORM,
     NULL_CONTEXT,
     get_current_time,
     get_current_run_folder,
     extract_profiler_results,
-    write_into_csv_with_column_names,
+    write_into_csv_in_batch,
     touch_file,
     read_json,
     retrier_factory,
@@ -50,6 +45,7 @@ from stnd.utility.utils import (
     get_project_root_path,
     itself_and_lower_upper_case,
     get_with_assert,
+    iter_split,
 )
 
 sys.path.pop(0)
@@ -64,6 +60,7 @@ ENV_VAR_PREFIX = "env_var"  # used in bash script e.g. for Condor
 PROGRESS_FREQUENCY = 0.01
 INDENT = "    "
 LOGGER_ARG_NAME = "logger"
+MISSING_LOGGER = object()
 
 
 # string style
@@ -121,6 +118,7 @@ WANDB_QUIET = True
 WANDB_INIT_RETRIES = 100
 WANDB_SLEEP_BETWEEN_INIT_RETRIES = 60
 PROJECT_KEY = "project"
+WANDB_TMP_FOLDER = os.path.join(get_system_root_path(), "tmp")
 
 
 # # Tensorboard
@@ -168,11 +166,15 @@ DEFAULT_GOOGLE_SERVICE_CREDENTIALS_PATH = os.path.join(
 DEFAULT_REFRESH_GOOGLE_CREDENTIALS = os.path.join(
     DEFAULT_GAUTH_FOLDER, "gauth_refresh_credentials.json"
 )
-URL_ID_RE = re.compile(r"id=([a-zA-Z0-9-_]+)")
-URL_KEY_RE = re.compile(r"key=([^&#]+)")
-URL_SPREADSHEET_RE = re.compile(r"/spreadsheets/d/([a-zA-Z0-9-_]+)")
-URL_FILE_RE = re.compile(r"/file/d/([a-zA-Z0-9-_]+)")
-URL_FOLDER_RE = re.compile(r"/folders/([a-zA-Z0-9-_]+)")
+URL_SPREADSHEET_ID_RE = re.compile(
+    r"key=(?P<key>[^&#]+)|/spreadsheets/d/(?P<spreadsheet>[a-zA-Z0-9-_]+)"
+)
+URL_GDRIVE_ID_RE = re.compile(
+    r"id=(?P<id>[a-zA-Z0-9-_]+)"
+    r"|key=(?P<key>[^&#]+)"
+    r"|/file/d/(?P<file>[a-zA-Z0-9-_]+)"
+    r"|/folders/(?P<folder>[a-zA-Z0-9-_]+)"
+)
 DEFAULT_GOOGLE_SCOPES = [
     "https://www.googleapis.com/auth/drive.file",
     "https://www.googleapis.com/auth/drive.install",
@@ -181,6 +183,10 @@ DEFAULT_GOOGLE_SCOPES = [
     "https://www.googleapis.com/auth/drive",
 ]
 FILE_TYPES_ALLOWED_TO_SYNC = ("text/plain", "application/x-yaml")
+# authenticated google clients are shared by all gspread/gdrive clients
+# of a process, because creating them reads credentials and refreshes tokens
+GOOGLE_CLIENTS = {}
+GOOGLE_CLIENTS_LOCK = threading.Lock()
 SPREADSHEETS_URL = "https://docs.google.com/spreadsheets"
 WORKSHEET_SEPARATOR = "::"
 DELTA_PREFIX = "delta"
@@ -198,18 +204,6 @@ DAEMON_SLEEP_TIME = 20
 TIME_TO_LOSE_LOCK_IF_CONCURRENT = 0.1
 
 
-if SYSTEM_PLATFORM == "darwin":
-    try:
-        mp.set_start_method("fork")
-    except RuntimeError:
-        # If start method is already set, verify it's 'fork'
-        if mp.get_start_method() != "fork":
-            raise RuntimeError(
-                "Multiprocessing start method is not 'fork'. "
-                "Current start method is: " + mp.get_start_method()
-            )
-
-
 def make_string_style(text_style, text_color):
     return (
         f"{CONTROL_PREFIX}{text_style}{CONTROL_SEPARATOR}"
@@ -220,12 +214,18 @@ def make_string_style(text_style, text_color):
 
 def infer_logger_from_args(*args, **kwargs):
     # class with self.logger
-    if hasattr(args[0], LOGGER_ARG_NAME):
-        return getattr(args[0], LOGGER_ARG_NAME)
+    logger = (
+        getattr(args[0], LOGGER_ARG_NAME, MISSING_LOGGER)
+        if args
+        else MISSING_LOGGER
+    )
+    if logger is not MISSING_LOGGER:
+        return logger
 
     # keyword logger
-    if LOGGER_ARG_NAME in kwargs:
-        return kwargs[LOGGER_ARG_NAME]
+    logger = kwargs.get(LOGGER_ARG_NAME, MISSING_LOGGER)
+    if logger is not MISSING_LOGGER:
+        return logger
 
     # one of the unnamed args
     for arg in args:
@@ -295,11 +295,44 @@ class TeeStd:
         return self.terminal.isatty()
 
 
+def register_output_file_locks_reset_at_fork(logger):
+    if not hasattr(os, "register_at_fork"):
+        return
+
+    # weak reference does not keep the logger alive for the registered hook
+    weak_reset = weakref.WeakMethod(logger.reset_output_file_locks)
+
+    def reset_in_child():
+        reset = weak_reset()
+        if reset is not None:
+            reset()
+
+    os.register_at_fork(after_in_child=reset_in_child)
+
+
+def compute_log_every_n_steps(total_steps, frequency=PROGRESS_FREQUENCY):
+    return (
+        max(1, round(frequency * total_steps)) if frequency is not None else 1
+    )
+
+
 # TODO(Alex | 13.07.2022) inherit from more sophisticated logger
 class RedneckLogger(BaseLogger):
-    def __init__(self, output_folder=None, retry_print=True, capture_std=True):
+    def __init__(
+        self,
+        output_folder=None,
+        retry_print=False,
+        capture_std=True,
+        use_file_lock=False,
+    ):
         warnings.showwarning = self.get_warning_wrapper()
 
+        # output files are written only by this process (gdrive sync is a
+        # thread), so a thread lock suffices unless use_file_lock is set,
+        # forked children (e.g. data loader workers) get their own locks
+        self.use_file_lock = use_file_lock
+        register_output_file_locks_reset_at_fork(self)
+
         # std capture
         self.original_stdout = None
         self.original_stderr = None
@@ -311,11 +344,15 @@ class RedneckLogger(BaseLogger):
             self.output_folder = None
             self.stdout_file = None
             self.stderr_file = None
+            self.stdout_lock = None
+            self.stderr_lock = None
 
         self.retry_print = retry_print
 
         self.cache = {}
         self.csv_output = None
+        # column -> value, written into csv_output on the next flush_csv
+        self.pending_csv_updates = {}
         self.tb_run = None
         self.wandb_run = None
         self.wandb_api = None
@@ -328,8 +365,8 @@ class RedneckLogger(BaseLogger):
         self.remote_stdout_url = None
         self.remote_stderr_url = None
         self.gdrive_daemon = None
-        self.stdout_lock = None
-        self.stderr_lock = None
+        self.gdrive_daemon_stop_event = None
+        self.synced_output_sizes = {}
         self.logging_handler_streams = (
             {}
         )  # Track original streams for logging handlers
@@ -354,12 +391,35 @@ class RedneckLogger(BaseLogger):
         self.stderr_file = os.path.join(new_output_folder, "stderr.txt")
         touch_file(self.stdout_file)
         touch_file(self.stderr_file)
-        self.stdout_lock = make_file_lock(self.stdout_file)
-        self.stderr_lock = make_file_lock(self.stderr_file)
+        self.stdout_lock = self.make_output_file_lock(self.stdout_file)
+        self.stderr_lock = self.make_output_file_lock(self.stderr_file)
         if self.std_capture_enabled:
             self.disable_std_capture()
             self.enable_std_capture()
 
+    def make_output_file_lock(self, output_file):
+        if self.use_file_lock:
+            return make_file_lock(output_file)
+        return threading.RLock()
+
+    def reset_output_file_locks(self):
+        """
+        Replace output file locks in a forked child,
+        inherited ones might be held by a thread that does not exist there.
+        """
+        # logger can be forked before its output files are set
+        if getattr(self, "stdout_lock", None) is None:
+            return
+        for stream in ("stdout", "stderr"):
+            old_lock = getattr(self, f"{stream}_lock")
+            new_lock = self.make_output_file_lock(
+                getattr(self, f"{stream}_file")
+            )
+            setattr(self, f"{stream}_lock", new_lock)
+            tee_std = getattr(sys, stream)
+            if isinstance(tee_std, TeeStd) and tee_std.file_lock is old_lock:
+                tee_std.file_lock = new_lock
+
     def enable_std_capture(self):
         """Redirect sys.stdout to capture all prints (including from libraries)"""
         if (
@@ -506,25 +566,22 @@ class RedneckLogger(BaseLogger):
         )
 
     def start_gdrive_daemon(self, sync_time=DAEMON_SLEEP_TIME):
-        def daemon_task(logger, sync_time):
-            daemon_process = psutil.Process(os.getpid())
-
-            while True:
-                if daemon_process.parent() is not None:
-                    sync_output_with_remote(logger)
-
-                    time.sleep(sync_time)
-
-                else:
-                    sys.exit(0)
+        def daemon_task(logger, sync_time, stop_event):
+            # http clients are not thread-safe,
+            # so the daemon does not share the client of the main thread
+            gdrive_client = make_gdrive_client(logger, use_cache=False)
+            while not stop_event.wait(sync_time):
+                sync_output_with_remote(logger, gdrive_client)
 
         assert self.remote_stdout_url
         assert self.remote_stderr_url
 
-        self.gdrive_daemon = mp.Process(
-            target=daemon_task, args=(self, sync_time)
+        self.gdrive_daemon_stop_event = threading.Event()
+        self.gdrive_daemon = threading.Thread(
+            target=daemon_task,
+            args=(self, sync_time, self.gdrive_daemon_stop_event),
+            daemon=True,
         )
-        self.gdrive_daemon.daemon = True
         self.gdrive_daemon.start()
 
     def set_csv_output(self, csv_output_config):
@@ -533,12 +590,14 @@ class RedneckLogger(BaseLogger):
         assert ROW_NUMBER_KEY in csv_output_config
         assert os.path.exists(csv_output_config[PATH_KEY])
 
-        self.csv_output = copy.deepcopy(csv_output_config)
+        # flat dict of paths and scalars, so a shallow copy is enough
+        self.csv_output = dict(csv_output_config)
         if self.csv_output["spreadsheet_url"] is not None:
             self.gspread_client = make_gspread_client(
                 self, DEFAULT_GOOGLE_CREDENTIALS_PATH
             )
 
+    @retrier_factory_with_auto_logger()
     def log_csv(self, column_value_pairs):
         log_csv_for_concurrent(
             self.csv_output[PATH_KEY],
@@ -549,11 +608,19 @@ class RedneckLogger(BaseLogger):
             concurrent=False,
         )
 
+    def flush_csv(self):
+        if self.pending_csv_updates:
+            self.log_csv(list(self.pending_csv_updates.items()))
+            self.pending_csv_updates = {}
+
     def log_separator(self):
-        print(SEPARATOR)
+        print(SEPARATOR, flush=True)
 
-        if self.stdout_file:
-            print(SEPARATOR, file=open(self.stdout_file, "a"), flush=True)
+        # when std capture is enabled, TeeStd already handles file writing
+        if self.stdout_file and not self.std_capture_enabled:
+            self._write_to_output_file(
+                SEPARATOR + "\n", self.stdout_file, self.stdout_lock
+            )
 
     def progress(
         self,
@@ -561,12 +628,31 @@ class RedneckLogger(BaseLogger):
         current_step,
         total_steps,
         frequency=PROGRESS_FREQUENCY,
+        log_every_n_steps=None,
     ):
-        log_every_n_steps = (
-            max(1, round(PROGRESS_FREQUENCY * total_steps))
-            if frequency is not None
-            else 1
+        # callers that log many steps can compute log_every_n_steps once
+        if log_every_n_steps is None:
+            log_every_n_steps = compute_log_every_n_steps(
+                total_steps, frequency
+            )
+        self._log_progress(
+            descripion, current_step, total_steps, log_every_n_steps
         )
+
+    def progress_iter(
+        self, description, iterable, frequency=PROGRESS_FREQUENCY
+    ):
+        total_steps = len(iterable)
+        log_every_n_steps = compute_log_every_n_steps(total_steps, frequency)
+        for current_step, item in enumerate(iterable, start=1):
+            yield item
+            self._log_progress(
+                description, current_step, total_steps, log_every_n_steps
+            )
+
+    def _log_progress(
+        self, descripion, current_step, total_steps, log_every_n_steps
+    ):
         if (
             current_step % log_every_n_steps == 0
             or current_step == 1
@@ -651,22 +737,30 @@ class RedneckLogger(BaseLogger):
         carriage_return=False,
     ):
         msg_prefix = "{} {}".format(get_current_time(), prefix_keyword)
-        end_char = "" if carriage_return else "\n"
+        end_char = "\r" if carriage_return else "\n"
 
         # Determine which stream to print to based on output_file
         print_stream = sys.stdout
         if output_file == self.stderr_file:
             print_stream = sys.stderr
 
-        print(
-            self.make_log_message(
+        log_message = self.format_log_message(msg, msg_prefix, auto_newline)
+
+        # styled terminal line is wrapped with its style codes,
+        # so it is formatted separately from the plain line for the file
+        if prefix_style_code or message_style_code:
+            terminal_message = self.make_log_message(
                 msg,
                 msg_prefix,
                 prefix_style_code=prefix_style_code,
                 message_style_code=message_style_code,
                 auto_newline=auto_newline,
-                carriage_return=carriage_return,
-            ),
+            )
+        else:
+            terminal_message = log_message
+
+        print(
+            terminal_message,
             flush=True,
             end=end_char,
             file=print_stream,
@@ -675,24 +769,15 @@ class RedneckLogger(BaseLogger):
         # Only write to file separately if std_capture is not enabled
         # (when std_capture is enabled, TeeStd already handles file writing)
         if output_file and not self.std_capture_enabled:
-            with (
-                make_file_lock(output_file)
-                if output_file_lock is None
-                else output_file_lock
-            ):
-                print(
-                    self.make_log_message(
-                        msg,
-                        msg_prefix,
-                        prefix_style_code="",
-                        message_style_code="",
-                        auto_newline=auto_newline,
-                        carriage_return=carriage_return,
-                    ),
-                    file=open(output_file, "a"),
-                    flush=True,
-                    end=end_char,
-                )
+            self._write_to_output_file(
+                log_message + end_char, output_file, output_file_lock
+            )
+
+    def _write_to_output_file(self, text, output_file, output_file_lock):
+        assert output_file_lock is not None
+        with output_file_lock:
+            with open(output_file, "a") as f:
+                f.write(text)
 
     def make_log_message(
         self,
@@ -703,6 +788,10 @@ class RedneckLogger(BaseLogger):
         auto_newline=False,
         carriage_return=False,
     ):
+        """
+        Style codes are inserted before wrapping,
+        so with auto_newline they count towards the line width.
+        """
         outside_style_code = ""
         if prefix_style_code:
             assert message_style_code
@@ -720,6 +809,13 @@ class RedneckLogger(BaseLogger):
             MAX_LINE_LENGTH if auto_newline else 0,
         ) + ("\r" if carriage_return else "")
 
+    def format_log_message(self, msg, prefix, auto_newline=False):
+        """Same as make_log_message without style codes."""
+        return insert_char_before_max_width(
+            "{}: {}".format(prefix, msg),
+            MAX_LINE_LENGTH if auto_newline else 0,
+        )
+
     def get_warning_wrapper(self):
         def warning_wrapper(
             message, category, filename, lineno, file=None, line=None
@@ -741,12 +837,13 @@ class RedneckLogger(BaseLogger):
 
     def stop_gdrive_daemon(self):
         if self.gdrive_daemon:
-            self.gdrive_daemon.terminate()
+            self.gdrive_daemon_stop_event.set()
             self.gdrive_daemon.join()
+            self.gdrive_daemon = None
             sync_output_with_remote(self)
 
 
-def sync_output_with_remote(logger):
+def sync_output_with_remote(logger, gdrive_client=None):
     assert logger.stdout_file
     assert logger.stderr_file
     assert logger.remote_stdout_url
@@ -754,7 +851,8 @@ def sync_output_with_remote(logger):
     assert logger.stdout_lock
     assert logger.stderr_lock
 
-    gdrive_client = logger.get_gdrive_client()
+    if gdrive_client is None:
+        gdrive_client = logger.get_gdrive_client()
 
     with NamedTemporaryFile("w+t", newline="") as tmp_file:
         for file, url, lock in [
@@ -762,10 +860,16 @@ def sync_output_with_remote(logger):
             (logger.stderr_file, logger.remote_stderr_url, logger.stderr_lock),
         ]:
             with lock:
+                # output files are append-only,
+                # so unchanged size means nothing new to upload
+                file_size = os.path.getsize(file)
+                if logger.synced_output_sizes.get(file) == file_size:
+                    continue
                 shutil.copy(file, tmp_file.name)
             sync_local_file_with_gdrive(
                 gdrive_client, tmp_file.name, url, download=False, logger=logger
             )
+            logger.synced_output_sizes[file] = file_size
 
 
 def make_logger(output_folder=None):
@@ -789,12 +893,19 @@ def update_and_move_logger_output_folder(
     os.makedirs(new_output_folder, exist_ok=True)
     if logger.output_folder is not None:
         old_output_folder = logger.output_folder
-        shutil.copytree(
-            old_output_folder, new_output_folder, dirs_exist_ok=True
-        )
         logger.stderr_lock = None
         logger.stdout_lock = None
-        shutil.rmtree(old_output_folder)
+        try:
+            # renaming is possible only into an empty (here - removed) folder
+            # on the same filesystem
+            os.rmdir(new_output_folder)
+            os.rename(old_output_folder, new_output_folder)
+        except OSError:
+            os.makedirs(new_output_folder, exist_ok=True)
+            shutil.copytree(
+                old_output_folder, new_output_folder, dirs_exist_ok=True
+            )
+            shutil.rmtree(old_output_folder)
     logger.update_output_folder(new_output_folder)
 
 
@@ -844,12 +955,17 @@ def try_to_log_in_csv(logger, column_name, value):
     try_to_log_in_csv_in_batch(logger, [(column_name, value)])
 
 
-def try_to_log_in_csv_in_batch(logger, column_value_pairs):
+def try_to_log_in_csv_in_batch(logger, column_value_pairs, flush=False):
     if logger.csv_output is not None:
-        logger.log_csv(column_value_pairs)
+        logger.pending_csv_updates.update(column_value_pairs)
+        if flush:
+            logger.flush_csv()
 
 
 def try_to_sync_csv_with_remote(logger, sync_row_zero=True):
+    if logger.csv_output is not None:
+        logger.flush_csv()
+
     if logger.gspread_client is not None:
         worksheet_names = (
             [logger.csv_output["worksheet_name"]]
@@ -867,12 +983,7 @@ def try_to_sync_csv_with_remote(logger, sync_row_zero=True):
         spreadsheet_url = logger.csv_output["spreadsheet_url"]
 
         if single_rows_per_csv is not None and sync_row_zero:
-            logger.gspread_client.upload_csvs_to_spreadsheet(
-                spreadsheet_url,
-                csv_files,
-                worksheet_names=worksheet_names,
-                single_rows_per_csv=[0],
-            )
+            single_rows_per_csv = [[0] + single_rows_per_csv]
 
         logger.gspread_client.upload_csvs_to_spreadsheet(
             spreadsheet_url,
@@ -937,17 +1048,17 @@ def insert_char_before_max_width(
     if len(input_string) == 0 or max_width == 0:
         return input_string
     current_line = ""
-    result = ""
-    for word in input_string.split(separator):
+    lines = []
+    for word in iter_split(input_string, separator):
         if current_line == "":
             current_line = word
         elif len(current_line) + len(word) <= max_width:
             current_line = current_line + separator + word
         else:
-            result += current_line + char
+            lines.append(current_line)
             current_line = indent + word
-    result += current_line
-    return result
+    lines.append(current_line)
+    return char.join(lines)
 
 
 @contextlib.contextmanager
@@ -1037,9 +1148,7 @@ def redneck_logger_context(
     if use_wandb:
         wandb_config = logging_config["wandb"]
         wandb_dir = os.path.join(
-            get_system_root_path(),
-            "tmp",
-            f"wandb_{get_hostname()}_{os.getpid()}",
+            WANDB_TMP_FOLDER, f"wandb_{get_hostname()}_{os.getpid()}"
         )
         os.makedirs(wandb_dir, exist_ok=True)
         if use_tb and wandb_config.get("sync_tb", False):
@@ -1257,9 +1366,11 @@ def delete_run_folders(inputs_csv):
     inputs_as_dict = read_csv_as_dict(inputs_csv)
     for row in inputs_as_dict.values():
         assert RUN_FOLDER_CSV_COLUMN in row
-        run_folder_path = row[RUN_FOLDER_CSV_COLUMN]
-        if os.path.exists(run_folder_path):
-            shutil.rmtree(run_folder_path)
+        # rmtree stats the path anyway, so no separate existence check
+        try:
+            shutil.rmtree(row[RUN_FOLDER_CSV_COLUMN])
+        except FileNotFoundError:
+            pass
 
 
 # def tb_log(
@@ -1275,17 +1386,6 @@ def delete_run_folders(inputs_csv):
 #         assert is_number(value), \
 #                 "Only scalars are supported for tensorboard."
 
-#     def log_stat_func_wrapper(tb_run, nested_key_as_list, step):
-
-#         def log_stat_for_given_args(value):
-#             stat_name = ".".join(nested_key_as_list)
-#             assert_scalar(value)
-
-#             tb_run.add_scalar(stat_name, value, global_step=step)
-#             return value
-
-#         return log_stat_for_given_args
-
 #     def log_multiple_curves(tb_run, stats_dict, step):
 
 #         assert is_nested_dict(stats_dict)
@@ -1311,18 +1411,19 @@ def delete_run_folders(inputs_csv):
 
 #     else:
 
-#         dict_leaves_as_nested_keys = get_leaves_of_nested_dict(stats_dict)
-
-#         for nested_key_as_list in dict_leaves_as_nested_keys:
+#         for nested_key_as_list, value in iterate_leaves_of_nested_dict(
+#             stats_dict
+#         ):
 
 #             assert len(nested_key_as_list)
 #             if skip_key_func is not None and skip_key_func(nested_key_as_list):
 #                 continue
 
-#             apply_func_to_dict_by_nested_key(
-#                 stats_dict,
-#                 nested_key_as_list,
-#                 func=log_stat_func_wrapper(tb_run, nested_key_as_list, step)
+#             assert_scalar(value)
+#             tb_run.add_scalar(
+#                 ".".join(nested_key_as_list),
+#                 value,
+#                 global_step=step
 #             )
 
 #     if flush:
@@ -1330,24 +1431,31 @@ def delete_run_folders(inputs_csv):
 
 
 def extract_id_from_spreadsheet_url(spreadsheet_url):
-    return extract_by_regex_from_url(
-        spreadsheet_url, [URL_KEY_RE, URL_SPREADSHEET_RE]
+    return extract_by_named_regex_from_url(
+        spreadsheet_url, URL_SPREADSHEET_ID_RE
     )
 
 
 def extract_id_from_gdrive_url(gdrive_url):
-    return extract_by_regex_from_url(
-        gdrive_url, [URL_ID_RE, URL_KEY_RE, URL_FILE_RE, URL_FOLDER_RE]
-    )
+    return extract_by_named_regex_from_url(gdrive_url, URL_GDRIVE_ID_RE)
+
 
+# regex is an alternation of named groups, only one of which can match
+def extract_by_named_regex_from_url(url, regex):
+    match = regex.search(url)
+    if match is None:
+        raise Exception(f"No valid key found in URL: {url}.")
+    return match.group(match.lastgroup)
 
-def extract_by_regex_from_url(url, regexes):
-    for regex in regexes:
-        match = regex.search(url)
-        if match:
-            return match.group(1)
 
-    raise Exception(f"No valid key found in URL: {url}.")
+def get_cached_google_client(client_type, credentials, create_client):
+    # forked processes should not share connections with their parent,
+    # threads that need their own client should pass use_cache=False
+    key = (os.getpid(), client_type, credentials, get_gauth_credentials_path())
+    with GOOGLE_CLIENTS_LOCK:
+        if key not in GOOGLE_CLIENTS:
+            GOOGLE_CLIENTS[key] = create_client()
+        return GOOGLE_CLIENTS[key]
 
 
 def get_gauth_credentials_path():
@@ -1360,10 +1468,16 @@ class GspreadClient:
     def __init__(self, logger, gspread_credentials):
         self.logger = logger
         self.gspread_credentials = gspread_credentials
-        self.client = self._create_client()
+        self.client = get_cached_google_client(
+            "gspread", gspread_credentials, self._create_client
+        )
+        # {spreadsheet id: {worksheet title: worksheet}}
+        self.worksheets_cache = {}
 
     @retrier_factory_with_auto_logger()
     def _create_client(self):
+        import gspread
+
         credentials_path = get_gauth_credentials_path()
         if os.path.exists(credentials_path):
             return gspread.service_account(filename=credentials_path)
@@ -1394,6 +1508,17 @@ class GspreadClient:
         else:
             return self.client.open_by_url(spreadsheet_url)
 
+    def get_worksheets(self, spreadsheet):
+        if spreadsheet.id not in self.worksheets_cache:
+            self.worksheets_cache[spreadsheet.id] = {
+                worksheet.title: worksheet
+                for worksheet in spreadsheet.worksheets()
+            }
+        return self.worksheets_cache[spreadsheet.id]
+
+    def invalidate_worksheets(self, spreadsheet):
+        self.worksheets_cache.pop(spreadsheet.id, None)
+
     @retrier_factory_with_auto_logger()
     def upload_csvs_to_spreadsheet(
         self,
@@ -1418,66 +1543,99 @@ class GspreadClient:
 
         spreadsheet = self.get_spreadsheet_by_url(spreadsheet_url)
 
-        existing_worksheets = list(spreadsheet.worksheets())
-        first_worksheet = existing_worksheets[0]
-        existing_worksheets = list(
-            worksheet.title for worksheet in existing_worksheets
-        )
+        existing_worksheets = self.get_worksheets(spreadsheet)
+        first_worksheet = next(iter(existing_worksheets.values()))
 
         if new_spreadsheet:
-            worksheet_names = []
-            for csv_file_path in csv_files:
-                worksheet_names.append(
-                    extract_csv_name_from_path(csv_file_path)
-                )
+            worksheet_names = [
+                extract_csv_name_from_path(csv_file_path)
+                for csv_file_path in csv_files
+            ]
         elif worksheet_names is None:
-            worksheet_names = existing_worksheets
-
-        existing_worksheets = set(existing_worksheets)
+            worksheet_names = list(existing_worksheets)
 
         assert len(worksheet_names) == len(csv_files)
 
-        removed_default_worksheet = False
+        existing_titles = set(existing_worksheets)
+        sheet_requests = []
+        for worksheet_name in worksheet_names:
+            if worksheet_name not in existing_titles:
+                sheet_requests.append(
+                    {
+                        "addSheet": {
+                            "properties": {
+                                "title": worksheet_name,
+                                "gridProperties": {
+                                    "rowCount": DEFAULT_SPREADSHEET_ROWS,
+                                    "columnCount": DEFAULT_SPREADSHEET_COLS,
+                                },
+                            }
+                        }
+                    }
+                )
+                existing_titles.add(worksheet_name)
 
-        for i in range(len(csv_files)):
-            csv_file_path = csv_files[i]
-            worksheet_name = worksheet_names[i]
+        if new_spreadsheet and first_worksheet.title not in worksheet_names:
+            sheet_requests.append(
+                {"deleteSheet": {"sheetId": first_worksheet.id}}
+            )
 
-            single_row = None
-            if single_rows_per_csv is not None:
-                single_row = single_rows_per_csv[i]
+        if len(sheet_requests) > 0:
+            self.invalidate_worksheets(spreadsheet)
+            spreadsheet.batch_update({"requests": sheet_requests})
+
+        # csvs stay locked until the batch request returns,
+        # so that an older upload can't overwrite a newer one,
+        # locks are taken in sorted order to avoid deadlocks between processes
+        with contextlib.ExitStack() as csv_locks:
+            for csv_file_path in sorted(set(csv_files)):
+                csv_locks.enter_context(make_file_lock(csv_file_path))
+
+            data = []
+            for i in range(len(csv_files)):
+                csv_file_path = csv_files[i]
+                worksheet_name = worksheet_names[i]
+
+                # single row can also be a list of rows of the same csv
+                single_rows = None
+                if single_rows_per_csv is not None:
+                    single_rows = single_rows_per_csv[i]
+                    if not isinstance(single_rows, list):
+                        single_rows = [single_rows]
+
+                csv_file_as_list = read_csv_as_list(
+                    csv_file_path,
+                    max_rows=(
+                        None if single_rows is None else max(single_rows) + 1
+                    ),
+                )
 
-            with make_file_lock(csv_file_path):
-                if not worksheet_name in existing_worksheets:
-                    spreadsheet.add_worksheet(
-                        title=worksheet_name,
-                        rows=DEFAULT_SPREADSHEET_ROWS,
-                        cols=DEFAULT_SPREADSHEET_COLS,
+                if single_rows is None:
+                    data.append(
+                        {"range": worksheet_name, "values": csv_file_as_list}
                     )
-                    existing_worksheets.add(worksheet_name)
-
-                if (
-                    new_spreadsheet
-                    and worksheet_name != first_worksheet
-                    and not removed_default_worksheet
-                ):
-                    assert len(existing_worksheets) == 2
-                    spreadsheet.del_worksheet(first_worksheet)
-                    removed_default_worksheet = True
+                    continue
 
-                csv_file_as_list = list(csv.reader(open(csv_file_path)))
-
-                a1_range_to_update = worksheet_name
-                if single_row is not None:
+                for single_row in single_rows:
                     gsheets_row = str(single_row + 1)
-                    a1_range_to_update += "!" + gsheets_row + ":" + gsheets_row
-                    csv_file_as_list = [csv_file_as_list[single_row]]
+                    a1_range_to_update = (
+                        worksheet_name + "!" + gsheets_row + ":" + gsheets_row
+                    )
+                    data.append(
+                        {
+                            "range": a1_range_to_update,
+                            "values": [csv_file_as_list[single_row]],
+                        }
+                    )
 
-                spreadsheet.values_update(
-                    a1_range_to_update,
-                    params={"valueInputOption": "USER_ENTERED"},
-                    body={"values": csv_file_as_list},
+            try:
+                spreadsheet.values_batch_update(
+                    body={"valueInputOption": "USER_ENTERED", "data": data}
                 )
+            except Exception:
+                # cached worksheets might have been changed by someone else
+                self.invalidate_worksheets(spreadsheet)
+                raise
 
         return spreadsheet.url
 
@@ -1493,18 +1651,31 @@ class GspreadClient:
 
         spreadsheet = self.get_spreadsheet_by_url(spreadsheet_url)
 
-        worksheets_dict = build_spreadsheet_dict(spreadsheet, worksheet_names)
+        if worksheet_names is None:
+            worksheet_names = list(self.get_worksheets(spreadsheet))
+
+        try:
+            value_ranges = spreadsheet.values_batch_get(
+                ranges=[
+                    "'{}'".format(name.replace("'", "''"))
+                    for name in worksheet_names
+                ]
+            )["valueRanges"]
+        except Exception:
+            # cached worksheets might have been changed by someone else
+            self.invalidate_worksheets(spreadsheet)
+            raise
 
         result = []
-        for name, sheet in worksheets_dict.items():
-            df = pd.DataFrame(sheet.get_all_values())
-
-            df.rename(columns=df.iloc[0], inplace=True)
-            df.drop(df.index[0], inplace=True)
+        for name, value_range in zip(worksheet_names, value_ranges):
             csv_path = os.path.join(
                 folder_for_csv, downloaded_files_prefix + name + ".csv"
             )
-            df.to_csv(csv_path, index=False)
+            # first row is the header, as in the worksheet
+            with open(csv_path, "w", newline="") as csv_file:
+                csv.writer(csv_file, lineterminator="\n").writerows(
+                    pad_rows(value_range.get("values", [[]]))
+                )
             result.append(csv_path)
 
         return result
@@ -1516,30 +1687,43 @@ def make_gspread_client(
     return GspreadClient(logger, gspread_credentials=gspread_credentials)
 
 
-def build_spreadsheet_dict(spreadsheet, worksheet_names):
-    if worksheet_names is None:
-        worksheets_dict = {
-            worksheet.title: worksheet for worksheet in spreadsheet.worksheets()
-        }
+def read_csv_as_list(csv_file_path, max_rows=None):
+    with open(
+        csv_file_path, newline="", buffering=CSV_READ_BUFFER_SIZE
+    ) as csv_file:
+        if max_rows is not None:
+            # rows after the last needed one are not parsed
+            return list(itertools.islice(csv.reader(csv_file), max_rows))
+        text = csv_file.read()
 
-    else:
-        worksheets_dict = {
-            worksheet_name: spreadsheet.worksheet(worksheet_name)
-            for worksheet_name in worksheet_names
-        }
+    # without quoted fields and "\r" line endings
+    # plain splitting gives the same rows as csv.reader
+    if '"' in text or "\r" in text:
+        return list(csv.reader(io.StringIO(text)))
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return [line.split(",") if line else [] for line in lines]
 
-    return worksheets_dict
+
+def pad_rows(rows):
+    # Sheets API omits trailing empty cells
+    num_cols = max(len(row) for row in rows)
+    return [row + [""] * (num_cols - len(row)) for row in rows]
 
 
 def extract_csv_name_from_path(csv_file_path):
-    assert ".csv" in csv_file_path
-    return os.path.basename(csv_file_path).replace(".csv", "")
+    csv_name, extension = os.path.splitext(os.path.basename(csv_file_path))
+    assert extension == ".csv", f"Expected a .csv file: {csv_file_path}"
+    return csv_name
 
 
 @retrier_factory_with_auto_logger(
     max_retries=WANDB_INIT_RETRIES, sleep_time=WANDB_SLEEP_BETWEEN_INIT_RETRIES
 )
 def init_wandb_run(wandb_config, exp_name, wandb_dir, config, logger):
+    import wandb
+
     wandb_password = get_value_from_config(
         wandb_config["netrc_path"], "password"
     )
@@ -1564,15 +1748,23 @@ def init_wandb_run(wandb_config, exp_name, wandb_dir, config, logger):
 
 
 class GdriveClient:
-    def __init__(self, logger, credentials_file):
+    def __init__(self, logger, credentials_file, use_cache=True):
         self.logger = logger
 
         self.credentials = credentials_file
 
-        self.client = self._create_client()
+        if use_cache:
+            self.client = get_cached_google_client(
+                "gdrive", credentials_file, self._create_client
+            )
+        else:
+            self.client = self._create_client()
 
     @retrier_factory_with_auto_logger()
     def _create_client(self):
+        from pydrive2.auth import GoogleAuth
+        from pydrive2.drive import GoogleDrive
+
         credentials_path = get_gauth_credentials_path()
         if os.path.exists(credentials_path):
             settings = {
@@ -1590,6 +1782,8 @@ class GdriveClient:
     def get_node_by_id(self, node_id):
         return self.client.CreateFile({"id": node_id})
 
+    # not retried, because the node can be created even if the request fails,
+    # and a retry would create a duplicate
     def create_node(self, node_name, node_type, parent_folder_id=None):
         metadata = {"title": node_name}
 
@@ -1613,9 +1807,11 @@ class GdriveClient:
 
 
 def make_gdrive_client(
-    logger, credentials_file=DEFAULT_GOOGLE_CREDENTIALS_PATH
+    logger, credentials_file=DEFAULT_GOOGLE_CREDENTIALS_PATH, use_cache=True
 ):
-    return GdriveClient(logger, credentials_file=credentials_file)
+    return GdriveClient(
+        logger, credentials_file=credentials_file, use_cache=use_cache
+    )
 
 
 def make_google_auth(
@@ -1624,6 +1820,8 @@ def make_google_auth(
     scopes=DEFAULT_GOOGLE_SCOPES,
     logger=None,
 ):
+    from pydrive2.auth import GoogleAuth, RefreshError
+
     def do_gauth(settings):
         gauth = GoogleAuth(settings=settings)
         gauth.CommandLineAuth()
@@ -1669,6 +1867,8 @@ def sync_local_file_with_gdrive(
         remote_file.GetContentFile(local_filepath)
     else:
         remote_file.SetContentFile(local_filepath)
+        # pydrive2 already uploads resumably in googleapiclient's
+        # default chunks of 100 MiB, so one request per log file
         remote_file.Upload()
     return remote_file
 
@@ -1678,36 +1878,49 @@ def get_gdrive_file_by_url(gdrive_client, remote_url):
     return gdrive_client.get_node_by_id(file_id)
 
 
-def log_csv_for_concurrent(csv_path, row_col_value_triplets, concurrent=True):
+def log_csv_for_concurrent(
+    csv_path, row_col_value_triplets, concurrent=True, verify=False
+):
     if concurrent:
         lock = make_file_lock(csv_path)
-        row_col_value_triplets_clean = []
     else:
         lock = NULL_CONTEXT
+    # as_str_for_csv removes chars with str.replace,
+    # which for a single char is much faster than str.translate
     remove_chars = [QUOTE_CHAR]
 
-    with lock:
-        for csv_row_number, column_name, value in row_col_value_triplets:
-            column_name = as_str_for_csv(column_name, remove_chars)
-            value = as_str_for_csv(value, remove_chars)
-            if concurrent:
-                row_col_value_triplets_clean.append(
-                    (csv_row_number, column_name, value)
-                )
+    row_col_value_triplets_clean = [
+        (
+            csv_row_number,
+            as_str_for_csv(column_name, remove_chars),
+            as_str_for_csv(value, remove_chars),
+        )
+        for csv_row_number, column_name, value in row_col_value_triplets
+    ]
 
-            write_into_csv_with_column_names(
-                csv_path,
-                csv_row_number,
-                column_name,
-                value,
-                replace_nulls=True,
-                use_lock=False,
-            )
+    if len(row_col_value_triplets_clean) == 0:
+        return
 
-    if concurrent:
+    with lock:
+        write_into_csv_in_batch(
+            csv_path,
+            row_col_value_triplets_clean,
+            replace_nulls=True,
+            use_lock=False,
+        )
+
+    # re-reading the file to check that no concurrent write
+    # overrode the values is slow, so it is done only on request
+    if concurrent and verify:
         time.sleep(TIME_TO_LOSE_LOCK_IF_CONCURRENT)
         with lock:
-            csv_as_dict = read_csv_as_dict(csv_path)
+            csv_as_dict = read_csv_as_dict(
+                csv_path,
+                row_numbers=[
+                    csv_row_number
+                    for csv_row_number, _, _ in row_col_value_triplets_clean
+                ],
+            )
 
         for csv_row_number, column_name, value in row_col_value_triplets_clean:
             found_value = csv_as_dict.get(csv_row_number, {}).get(column_name)
@@ -1731,17 +1944,32 @@ class RedneckProgressBar:
         self.description = description
         self.total_steps = total_steps
         self.current_step = 0
+        # printing every step floods stdout for long loops
+        self.print_every_n_steps = max(1, total_steps // 1000)
+        self.next_print_step = 1
+        self.log_every_n_steps = compute_log_every_n_steps(total_steps)
 
     def update(self):
         self.current_step += 1
         if self.logger is None:
-            print(
-                f"{self.description}: "
-                f"{self.current_step}/{self.total_steps}"
-            )
+            if (
+                self.current_step >= self.next_print_step
+                or self.current_step == self.total_steps
+            ):
+                self.next_print_step = (
+                    self.current_step + self.print_every_n_steps
+                )
+                print(
+                    f"{self.description}: "
+                    f"{self.current_step}/{self.total_steps}"
+                )
         else:
+            # logger.progress skips steps on its own
             self.logger.progress(
-                self.description, self.current_step, self.total_steps
+                self.description,
+                self.current_step,
+                self.total_steps,
+                log_every_n_steps=self.log_every_n_steps,
             )
 
 
@@ -23,18 +23,21 @@ import signal
 import platform
 import sys
 from collections import Counter
-from collections.abc import Iterable
 import itertools
+import functools
 import contextlib
+import mmap
 
 # from watchdog.observers import Observer
 # from watchdog.events import FileSystemEventHandler
 import io
 import re
+import codecs
+import locale
 
 # import matplotlib.pyplot as plt
-import pandas as pd
 import threading
+import weakref
 
 # import gdown
 from urllib.parse import urlparse
@@ -42,13 +45,22 @@ import requests
 
 
 MAX_BUFFER_SIZE = 1000
+PIPE_READ_SIZE = 1 << 16
 SYSTEM_PLATFORM = platform.system().lower()
 DEFAULT_HASH_SIZE = 10
 DEFAULT_EXPERIMENTS_FOLDER = "experiments"
 PROFILER_GROUP_BY_STACK_N = 5
 PROFILER_OUTPUT_ROW_LIMIT = 10
-DEFAULT_FILE_CHUNK_SIZE = 4096
+DEFAULT_FILE_CHUNK_SIZE = 1 << 20
+MIN_FILE_SIZE_TO_HASH_MMAPED = 16 << 20
 EMPTY_CSV_TOKEN = "?"
+CSV_READ_BUFFER_SIZE = 1 << 20
+# libyaml based loader and dumper are much faster, when pyyaml is built with it
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, "CDumper", yaml.Dumper)
+STUNED_ROOT_PATH = os.path.abspath(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+)
 DEFAULT_ENV_NAME = os.environ.get("DEFAULT_ENV", None)
 TEST_ENV_NAME = os.environ.get("TEST_ENV", None)
 BASHRC_PATH = os.path.join(
@@ -76,8 +88,18 @@ DELIMETER = ","
 QUOTE_CHAR = '"'
 ESCAPE_CHAR = "\\"
 INF = float("Inf")
+KEY_NOT_FOUND = object()
 TOL = 1e6
 EXPONENTIAL_SYMBOLS = ("e", "E")
+# strings decoded as None, False and True, as written, lower or upper case
+NONE_STRINGS = frozenset(("None", "none", "NONE", "Null", "null", "NULL"))
+FALSE_STRINGS = frozenset(("False", "false", "FALSE"))
+TRUE_STRINGS = frozenset(("True", "true", "TRUE"))
+# optional leading minus, at most one floating point and one exponent
+# (optionally signed and followed by at least one digit)
+NUMBER_RE = re.compile(
+    r"-?(?:\d*\.?\d*|\d*\.?\d*[eE][+-]?\d+|\d*[eE][+-]?\d*\.\d+)"
+)
 
 
 # matplotlib
@@ -105,12 +127,17 @@ class ChildrenForPicklingPreparer:
 
 
 def object_attributes(obj):
-    return filter(lambda a: not a.startswith("__"), dir(obj))
+    # dir() is needed instead of __dict__, because children can be
+    # reachable only through __getattr__ and __dir__ (e.g. torch submodules),
+    # list allows preparing a child to add attributes during the iteration
+    return [
+        attr_name for attr_name in dir(obj) if not attr_name.startswith("__")
+    ]
 
 
 def read_yaml(yaml_file):
     with open(yaml_file, "r") as stream:
-        return yaml.safe_load(stream)
+        return yaml.load(stream, Loader=YAML_LOADER)
 
 
 def apply_random_seed(random_seed):
@@ -152,30 +179,22 @@ def append_dict(total_dict, current_dict, allow_new_keys=False):
     to leaf lists of possibly nested <total_dict>
     """
 
-    def to_create_new_key(is_new_total_dict, allow_new_keys, key, total_dict):
-        return is_new_total_dict or (allow_new_keys and key not in total_dict)
-
-    is_new_total_dict = False
-    if len(total_dict) == 0:
-        is_new_total_dict = True
+    is_new_total_dict = not total_dict
     for key, value in current_dict.items():
+        to_create_new_key = is_new_total_dict or (
+            allow_new_keys and key not in total_dict
+        )
         if isinstance(value, dict):
-            if to_create_new_key(
-                is_new_total_dict, allow_new_keys, key, total_dict
-            ):
+            if to_create_new_key:
                 sub_dict = {}
-                append_dict(sub_dict, value, allow_new_keys=allow_new_keys)
                 total_dict[key] = sub_dict
             else:
                 assert key in total_dict
                 sub_dict = total_dict[key]
                 assert isinstance(sub_dict, dict)
-                append_dict(sub_dict, value, allow_new_keys=allow_new_keys)
-                total_dict[key] = sub_dict
+            append_dict(sub_dict, value, allow_new_keys=allow_new_keys)
         else:
-            if to_create_new_key(
-                is_new_total_dict, allow_new_keys, key, total_dict
-            ):
+            if to_create_new_key:
                 total_dict[key] = [value]
             else:
                 assert key in total_dict
@@ -251,9 +270,7 @@ def run_cmd_through_popen(
             if buffer_processor is not None:
                 buffer_processor(prev_buffer + buffer)
             log_func(buffer, logger)
-            prev_buffer = buffer
-            buffer = ""
-            return buffer, prev_buffer
+            return buffer
 
         buffer = ""
         prev_buffer = ""
@@ -265,17 +282,32 @@ def run_cmd_through_popen(
             out = process.stderr
             log_func = error_or_print
 
+        # read whatever is available from the raw pipe instead of
+        # going line by line, decoding as text=True would do
+        fd = out.fileno()
+        decoder = io.IncrementalNewlineDecoder(
+            codecs.getincrementaldecoder(locale.getpreferredencoding(False))(
+                errors="replace"
+            ),
+            translate=True,
+        )
+
         while True:
-            output = out.readline()
-            if output == "" and process.poll() is not None:
+            output = os.read(fd, PIPE_READ_SIZE)
+            buffer += decoder.decode(output, final=(output == b""))
+            if output == b"":
                 break
 
-            buffer += output
-
-            if output == "\n" or len(buffer) > MAX_BUFFER_SIZE:
-                buffer, prev_buffer = process_buffer(
-                    buffer, prev_buffer, buffer_processor, log_func
+            # only complete lines are processed,
+            # unless a single line gets too long
+            lines_end = buffer.rfind("\n") + 1
+            if lines_end == 0 and len(buffer) > MAX_BUFFER_SIZE:
+                lines_end = len(buffer)
+            if lines_end > 0:
+                prev_buffer = process_buffer(
+                    buffer[:lines_end], prev_buffer, buffer_processor, log_func
                 )
+                buffer = buffer[lines_end:]
 
         if buffer != "":
             process_buffer(buffer, prev_buffer, buffer_processor, log_func)
@@ -285,7 +317,6 @@ def run_cmd_through_popen(
         shell=True,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
-        text=True,
     )
 
     log_or_print(f"Process started by runner has id: {process.pid}", logger)
@@ -359,11 +390,7 @@ def get_project_root_path():
 
 
 def get_stuned_root_path():
-    return os.path.abspath(
-        os.path.dirname(
-            os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        )
-    )
+    return STUNED_ROOT_PATH
 
 
 def make_unique_run_name(hashed_config_diff):
@@ -453,30 +480,41 @@ def get_leaves_of_nested_dict(
     include_values=False,
     allow_empty_dict=False,
 ):
-    result = []
-    if len(nested_dict) == 0:
-        if allow_empty_dict:
-            return result
-        else:
+    return [
+        (nested_key_as_list, value) if include_values else nested_key_as_list
+        for nested_key_as_list, value in iterate_leaves_of_nested_dict(
+            nested_dict,
+            nested_key_prefix=nested_key_prefix,
+            allow_empty_dict=allow_empty_dict,
+        )
+    ]
+
+
+def iterate_leaves_of_nested_dict(
+    nested_dict, nested_key_prefix=[], allow_empty_dict=False
+):
+    """
+    Yield (nested_key_as_list, value) for each leaf of a nested dict
+    in depth-first order, walking the dict only once and without recursion.
+    """
+
+    def assert_not_empty(current_dict):
+        if len(current_dict) == 0 and not allow_empty_dict:
             raise ValueError("Nested dict is empty.")
-    for key, value in nested_dict.items():
-        current_prefix = nested_key_prefix + [key]
-        if isinstance(value, dict):
-            result.extend(
-                get_leaves_of_nested_dict(
-                    value,
-                    nested_key_prefix=current_prefix,
-                    include_values=include_values,
-                    allow_empty_dict=allow_empty_dict,
-                )
-            )
-        else:
-            if include_values:
-                result.append((current_prefix, value))
-            else:
-                result.append(current_prefix)
 
-    return result
+    assert_not_empty(nested_dict)
+    stack = [(nested_key_prefix, iter(nested_dict.items()))]
+    while stack:
+        current_prefix, items = stack[-1]
+        for key, value in items:
+            nested_key_as_list = current_prefix + [key]
+            if isinstance(value, dict):
+                assert_not_empty(value)
+                stack.append((nested_key_as_list, iter(value.items())))
+                break
+            yield nested_key_as_list, value
+        else:
+            stack.pop()
 
 
 def update_dict_by_nested_key(
@@ -564,11 +602,21 @@ def remove_all_but_subdirs(src_folder, objects_to_keep):
     for object_name in objects_to_keep:
         assert os.path.exists(os.path.join(src_folder, object_name))
     objects_to_keep = set(objects_to_keep)
-    objects_in_folder_before = os.listdir(src_folder)
-    for object_name in objects_in_folder_before:
-        if not object_name in objects_to_keep:
-            remove_file_or_folder(os.path.join(src_folder, object_name))
-    assert len(objects_to_keep) == len(os.listdir(src_folder))
+    num_kept = 0
+    # dir entries already know their types, so no extra stat calls are needed
+    with os.scandir(src_folder) as entries:
+        for entry in entries:
+            if entry.name in objects_to_keep:
+                num_kept += 1
+            elif entry.is_file():
+                os.remove(entry.path)
+            elif entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                raise_unknown(
+                    "file type", "", 'for object "{}"'.format(entry.path)
+                )
+    assert len(objects_to_keep) == num_kept
 
 
 def remove_file_or_folder(file_or_folder):
@@ -598,9 +646,18 @@ def compute_file_hash(
     filename, chunksize=DEFAULT_FILE_CHUNK_SIZE, hash_type="md5"
 ):
     hasher = get_hasher(hash_type)
-    with open(filename, "rb") as f:
-        for byte_block in iter(lambda: f.read(chunksize), b""):
-            hasher.update(byte_block)
+    # chunks are large enough to skip python's own buffering
+    with open(filename, "rb", buffering=0) as f:
+        if os.fstat(f.fileno()).st_size >= MIN_FILE_SIZE_TO_HASH_MMAPED:
+            # large files are hashed straight from the page cache
+            # without copying them into python bytes chunk by chunk
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mmap, "MADV_SEQUENTIAL"):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                hasher.update(mm)
+        else:
+            while byte_block := f.read(chunksize):
+                hasher.update(byte_block)
     return hasher.hexdigest()
 
 
@@ -609,10 +666,21 @@ def get_hasher(hash_type, hash_size=DEFAULT_HASH_SIZE):
         return md5()
     elif hash_type == "blake2b":
         return blake2b(digest_size=hash_size)
+    elif hash_type == "blake3":
+        # optional, much faster than md5 for large files;
+        # its digest is always 32 bytes, so hash_size is not used
+        try:
+            import blake3
+        except ImportError:
+            raise Exception(
+                'Hash type "blake3" requires "blake3" package to be installed.'
+            )
+        return blake3.blake3()
     else:
         raise_unknown("hash type", hash_type, "getting hasher")
 
 
+@functools.lru_cache(maxsize=1)
 def get_hostname():
     return socket.gethostname()
 
@@ -631,14 +699,12 @@ def remove_filename_extension(filename, must_have_extension=True):
 def range_for_each_group(num_groups, num_elements):
     assert num_elements >= num_groups
 
-    indices_per_group = int(num_elements / num_groups)
-    remainder = num_elements % num_groups
+    indices_per_group, remainder = divmod(num_elements, num_groups)
 
     return [
         (
-            group_id * indices_per_group + (min(group_id, remainder)),
-            (group_id + 1) * (indices_per_group)
-            + (min(group_id, remainder - 1) + 1),
+            group_id * indices_per_group + min(group_id, remainder),
+            (group_id + 1) * indices_per_group + min(group_id + 1, remainder),
         )
         for group_id in range(num_groups)
     ]
@@ -649,13 +715,10 @@ def coefficients_for_bases(number, bases):
     prev_base = float("Inf")
     for base in bases:
         assert prev_base > base
-        current_value = int(number / base)
-        combination.append(current_value)
-        number = number % base
-        if len(combination) < len(bases):
-            prev_base = base
-        else:
-            assert number == 0
+        current_value, number = divmod(number, base)
+        combination.append(int(current_value))
+        prev_base = base
+    assert number == 0
     return combination
 
 
@@ -668,11 +731,10 @@ def deterministic_subset(input_set, num_to_subsample):
     subsampled_idxs = np.linspace(
         0, len(input_set) - 1, num_to_subsample, dtype=np.int32
     )
-    res = set()
-    set_as_list = sorted(list(input_set))
-    for i in subsampled_idxs:
-        res.add(set_as_list[i])
-    return res
+    # timsort is faster here than np.partition on object arrays,
+    # which is what arbitrary set elements have to become in numpy
+    set_as_list = sorted(input_set)
+    return {set_as_list[i] for i in subsampled_idxs}
 
 
 def compute_proportion(proportion, total_number):
@@ -687,7 +749,7 @@ def make_autogenerated_config_name(input_csv_path, row_number):
 
 def save_as_yaml(output_file_name, data):
     with open(output_file_name, "w") as outfile:
-        yaml.dump(data, outfile, default_flow_style=False)
+        yaml.dump(data, outfile, Dumper=YAML_DUMPER, default_flow_style=False)
 
 
 def write_into_csv_pd(
@@ -698,45 +760,43 @@ def write_into_csv_pd(
     use_lock=True,
     allow_creating_file=False,
 ):
-    assert row_number > 0, "Rows enumeration starts with 1."
+    """
+    Insert <value> into row <row_number> and column <column_name>
+    of the csv file with path <file_path> written in the default csv dialect.
 
-    new_file = False
+    Unlike write_into_csv_with_column_names, missing rows are appended
+    and all rows are padded with empty cells to the header length.
+    Cells are kept as strings instead of being parsed by pandas.
+    """
 
-    row_number -= 1
+    assert row_number > 0, "Rows enumeration starts with 1."
 
     if not os.path.exists(file_path):
         if allow_creating_file:
-            tmp_col_name = "tmp_col"
-            new_file = True
             touch_file(file_path)
-            print(tmp_col_name, file=open(file_path, "w"))
         else:
             raise FileNotFoundError(f"File {file_path} does not exist")
 
     lock = make_file_lock(file_path) if use_lock else NULL_CONTEXT
 
     with lock:
-        df = pd.read_csv(file_path)
+        rows = read_csv_rows(file_path)
 
-        if new_file:
-            df = df.drop(columns=[tmp_col_name])
-
-        num_rows = df.shape[0]
-        if num_rows < row_number:
-            num_empty_rows_to_append = row_number - num_rows
-
-            empty_rows = pd.DataFrame(
-                {
-                    col: [pd.NA for _ in range(num_empty_rows_to_append)]
-                    for col in df.columns
-                }
-            )
+        if len(rows) == 0:
+            rows.append([])
+        header = rows[0]
+        if column_name not in header:
+            header.append(column_name)
+        pos_in_row = header.index(column_name)
 
-            df = pd.concat([df, empty_rows], ignore_index=True)
+        while len(rows) <= row_number:
+            rows.append([])
+        for row in rows[1:]:
+            row.extend([""] * (len(header) - len(row)))
 
-        df.at[row_number, column_name] = value
+        rows[row_number][pos_in_row] = "" if value is None else str(value)
 
-        df.to_csv(file_path, index=False)
+        write_csv_rows(file_path, rows, lineterminator="\n")
 
 
 def write_into_csv_with_column_names(
@@ -781,103 +841,164 @@ def write_into_csv_with_column_names(
         other args
     """
 
-    tempfile = NamedTemporaryFile("w+t", newline="", delete=False)
+    csv_dialect = dict(
+        delimiter=delimiter,
+        quotechar=quotechar,
+        quoting=quoting,
+        escapechar=escapechar,
+        doublequote=doublequote,
+    )
 
     lock = make_file_lock(file_path) if use_lock else NULL_CONTEXT
 
     with lock:
-        with open(file_path, "r", newline="") as csv_file, tempfile:
-            reader = csv.reader(
+        rows = read_csv_rows(file_path, replace_nulls, **csv_dialect)
+        insert_into_csv_rows(
+            rows, row_number, column_name, value, append_row, file_path
+        )
+        write_csv_rows(file_path, rows, **csv_dialect)
+
+
+def write_into_csv_in_batch(
+    file_path,
+    row_col_value_triplets,
+    delimiter=DELIMETER,
+    quotechar=QUOTE_CHAR,
+    quoting=csv.QUOTE_NONE,
+    escapechar=ESCAPE_CHAR,
+    doublequote=True,
+    replace_nulls=False,
+    use_lock=True,
+):
+    """
+    Equivalent to calling write_into_csv_with_column_names
+    for each (row_number, column_name, value) triplet in order,
+    but reads and rewrites the csv file only once.
+    """
+
+    csv_dialect = dict(
+        delimiter=delimiter,
+        quotechar=quotechar,
+        quoting=quoting,
+        escapechar=escapechar,
+        doublequote=doublequote,
+    )
+
+    lock = make_file_lock(file_path) if use_lock else NULL_CONTEXT
+
+    with lock:
+        rows = read_csv_rows(file_path, replace_nulls, **csv_dialect)
+        for row_number, column_name, value in row_col_value_triplets:
+            insert_into_csv_rows(
+                rows, row_number, column_name, value, file_path=file_path
+            )
+        write_csv_rows(file_path, rows, **csv_dialect)
+
+
+def read_csv_rows(file_path, replace_nulls=False, **csv_dialect):
+    with open(file_path, "r", newline="") as csv_file:
+        return list(
+            csv.reader(
                 (
                     (x.replace("\0", "") for x in csv_file)
                     if replace_nulls
                     else csv_file
                 ),
-                delimiter=delimiter,
-                quotechar=quotechar,
-                quoting=quoting,
-                escapechar=escapechar,
-                doublequote=doublequote,
-            )
-            writer = csv.writer(
-                tempfile,
-                delimiter=delimiter,
-                quotechar=quotechar,
-                quoting=quoting,
-                escapechar=escapechar,
-                doublequote=doublequote,
+                **csv_dialect,
             )
+        )
 
-            appended_column = False
-            value_inserted = False
-
-            num_rows = count_rows_in_file(csv_file)
-            num_cols = None
-
-            pos_in_row = None
 
-            if num_rows == 0:
-                assert row_number == 1, (
-                    "Can't insert into row number {} of empty file, "
-                    "only row number 1 is possible."
-                ).format(row_number)
+def write_csv_rows(file_path, rows, **csv_dialect):
+    # temporary file is created next to the target,
+    # so that it is renamed in place instead of being copied over
+    tempfile = NamedTemporaryFile(
+        "w+t",
+        newline="",
+        delete=False,
+        dir=os.path.dirname(os.path.abspath(file_path)),
+    )
+    try:
+        with tempfile:
+            csv.writer(tempfile, **csv_dialect).writerows(rows)
+        os.replace(tempfile.name, file_path)
+    except BaseException:
+        if os.path.exists(tempfile.name):
+            os.remove(tempfile.name)
+        raise
 
-                writer.writerow([column_name])
-                append_row = True
-                num_cols = 1
-                num_rows += 1
 
-            else:
-                for current_row_number, row in enumerate(reader):
-                    if current_row_number == 0:
-                        if column_name in row:
-                            pos_in_row = row.index(column_name)
-                        else:
-                            row.append(column_name)
-                            appended_column = True
-                            pos_in_row = len(row) - 1
-
-                    if current_row_number == row_number:
-                        assert pos_in_row is not None
-                        if appended_column and row_number > 0:
-                            row.append(value)
-                        else:
-                            assert len(row) > pos_in_row, (
-                                "CSV's contents are inconsistent "
-                                "with the number of columns "
-                                "for the file {}".format(file_path)
-                            )
-                            row[pos_in_row] = value
-                        value_inserted = True
-                    elif appended_column and current_row_number > 0:
-                        row.append(EMPTY_CSV_TOKEN)
-
-                    writer.writerow(row)
-                    num_cols = len(row)
-
-            if append_row:
-                assert num_cols is not None and num_cols > 0
-
-                assert row_number == num_rows
-
-                writer.writerow([value] + [EMPTY_CSV_TOKEN] * (num_cols - 1))
-                value_inserted = True
-
-        if not value_inserted:
-            raise Exception(
-                "CSV file {} has {} rows, while insertion "
-                "into row {} was requested!".format(
-                    file_path, num_rows, row_number
-                )
+def insert_into_csv_rows(
+    rows, row_number, column_name, value, append_row=False, file_path=None
+):
+    # see write_into_csv_with_column_names for the semantics
+    if len(rows) == 0:
+        assert row_number == 1, (
+            "Can't insert into row number {} of empty file, "
+            "only row number 1 is possible."
+        ).format(row_number)
+        rows.append([column_name])
+        rows.append([value])
+        return
+
+    header = rows[0]
+    appended_column = column_name not in header
+    if appended_column:
+        header.append(column_name)
+    pos_in_row = header.index(column_name)
+
+    if append_row:
+        assert row_number == len(rows)
+        if appended_column:
+            for row in rows[1:]:
+                row.append(EMPTY_CSV_TOKEN)
+        rows.append([value] + [EMPTY_CSV_TOKEN] * (len(rows[-1]) - 1))
+        return
+
+    if row_number >= len(rows):
+        raise Exception(
+            "CSV file {} has {} rows, while insertion "
+            "into row {} was requested!".format(
+                file_path, len(rows), row_number
             )
+        )
 
-        shutil.move(tempfile.name, file_path)
+    if appended_column:
+        for current_row_number in range(1, len(rows)):
+            rows[current_row_number].append(
+                value if current_row_number == row_number else EMPTY_CSV_TOKEN
+            )
+        if row_number > 0:
+            return
+
+    row = rows[row_number]
+    assert len(row) > pos_in_row, (
+        "CSV's contents are inconsistent "
+        "with the number of columns "
+        "for the file {}".format(file_path)
+    )
+    row[pos_in_row] = value
 
 
 def count_rows_in_file(file):
+    # count newlines in binary chunks instead of decoding every line,
+    # for text files the underlying binary buffer is used
+    binary_file = getattr(file, "buffer", file)
+    file.seek(0)
+
+    # rows end with "\n", "\r\n" or a bare "\r" as in universal newlines mode
     rowcount = 0
+    last_chunk = b""
+    while chunk := binary_file.read(DEFAULT_FILE_CHUNK_SIZE):
+        rowcount += (
+            chunk.count(b"\n") + chunk.count(b"\r") - chunk.count(b"\r\n")
+        )
+        # "\r\n" split between two chunks is a single row end
+        if last_chunk.endswith(b"\r") and chunk.startswith(b"\n"):
+            rowcount -= 1
+        last_chunk = chunk
 
-    for _ in file:
+    if last_chunk and not last_chunk.endswith((b"\n", b"\r")):
         rowcount += 1
 
     file.seek(0)
@@ -941,63 +1062,44 @@ def decode_val_from_str(
             list_end_symbol=list_end_symbol,
         )
 
-    elif value in itself_and_lower_upper_case(
-        "None"
-    ) or value in itself_and_lower_upper_case("Null"):
+    elif value in NONE_STRINGS:
         value = None
 
-    elif value in itself_and_lower_upper_case("False"):
+    elif value in FALSE_STRINGS:
         value = False
 
-    elif value in itself_and_lower_upper_case("True"):
+    elif value in TRUE_STRINGS:
         value = True
 
     return value
 
 
 def replace_many_by_one(input_string, items_to_replace, value_to_insert):
-    # TODO(Alex | 25.02.2023) do in O(n) with regex
-    for item_to_replace in items_to_replace:
-        if item_to_replace == value_to_insert:
-            continue
-
-        input_string = input_string.replace(item_to_replace, value_to_insert)
-
-    return input_string
+    items_to_replace = tuple(
+        item_to_replace
+        for item_to_replace in items_to_replace
+        if item_to_replace != value_to_insert
+    )
+    if len(items_to_replace) == 0:
+        return input_string
 
+    return make_alternation_regex(items_to_replace).sub(
+        lambda match: value_to_insert, input_string
+    )
 
-def str_is_number(input_str):
-    if len(input_str) == 0:
-        return False
 
-    exponential = False
-    has_floating_point = False
-    for i in range(len(input_str)):
-        if input_str[i].isdigit():
-            continue
-        if input_str[i] == "-":
-            if i == 0:
-                continue
-            elif exponential and input_str[i - 1] in EXPONENTIAL_SYMBOLS:
-                continue
-        if (
-            input_str[i] == "+"
-            and exponential
-            and input_str[i - 1] in EXPONENTIAL_SYMBOLS
-        ):
-            continue
-        if input_str[i] in EXPONENTIAL_SYMBOLS and not exponential:
-            exponential = True
-            continue
-        if input_str[i] == FLOATING_POINT and not has_floating_point:
-            has_floating_point = True
-            continue
-        return False
+@functools.lru_cache(maxsize=None)
+def make_alternation_regex(items):
+    # longer items go first, so that e.g. ", " is matched before ","
+    return re.compile(
+        "|".join(
+            re.escape(item) for item in sorted(items, key=len, reverse=True)
+        )
+    )
 
-    if exponential and not input_str[-1].isdigit():
-        return False
 
-    return True
+def str_is_number(input_str):
+    return len(input_str) > 0 and NUMBER_RE.fullmatch(input_str) is not None
 
 
 def parse_float_or_int_from_string(value_as_str):
@@ -1009,8 +1111,9 @@ def parse_float_or_int_from_string(value_as_str):
         return int(value_as_str)
 
 
-def escape_all_chars_in_string(input_string, escapechar=ESCAPE_CHAR):
-    return escapechar + escapechar.join(list(input_string))
+@functools.lru_cache(maxsize=None)
+def make_repeated_item_regex(item):
+    return re.compile(f"(?:{re.escape(item)})+")
 
 
 def parse_list_from_string(
@@ -1031,12 +1134,12 @@ def parse_list_from_string(
     else:
         value_as_str = value_as_str[1:-1]
 
-        replace_many_by_one(value_as_str, list_separators, list_separators[0])
+        value_as_str = replace_many_by_one(
+            value_as_str, list_separators, list_separators[0]
+        )
 
-        value_as_str = re.sub(
-            f"({escape_all_chars_in_string(list_separators[0])})+",
-            list_separators[0],
-            value_as_str,
+        value_as_str = make_repeated_item_regex(list_separators[0]).sub(
+            lambda match: list_separators[0], value_as_str
         )
 
         result_list = value_as_str.split(list_separators[0])
@@ -1059,11 +1162,26 @@ def read_csv_as_dict(
     quoting=csv.QUOTE_NONE,
     escapechar=ESCAPE_CHAR,
     doublequote=True,
+    row_numbers=None,
 ):
+    """
+    If row_numbers is given, only these rows (and the header row 0)
+    are kept and the file is not parsed past the last of them.
+    """
+
     result = {}
 
-    with open(csv_path, newline="") as input_csv:
-        csv_reader = csv.DictReader(
+    last_row_number = None
+    if row_numbers is not None:
+        row_numbers = set(row_numbers)
+        last_row_number = max(row_numbers, default=0)
+
+    with open(
+        csv_path, newline="", buffering=CSV_READ_BUFFER_SIZE
+    ) as input_csv:
+        # plain reader is faster than csv.DictReader,
+        # rows are converted to dicts the same way it does
+        csv_reader = csv.reader(
             input_csv,
             delimiter=delimeter,
             quotechar=quotechar,
@@ -1071,25 +1189,44 @@ def read_csv_as_dict(
             escapechar=escapechar,
             doublequote=doublequote,
         )
+        fieldnames = next(csv_reader, None)
 
         result[0] = {}
 
-        check_duplicates(csv_reader.fieldnames)
+        check_duplicates(fieldnames)
 
-        for fieldname in csv_reader.fieldnames:
+        for fieldname in fieldnames:
             result[0][fieldname] = fieldname
 
-        for csv_row_number, csv_row in enumerate(csv_reader):
-            result[csv_row_number + 1] = csv_row
+        if last_row_number == 0:
+            return result
+
+        num_fields = len(fieldnames)
+        csv_row_number = 0
+        for csv_row in csv_reader:
+            if len(csv_row) == 0:
+                continue
+            csv_row_number += 1
+            if row_numbers is None or csv_row_number in row_numbers:
+                row_as_dict = dict(zip(fieldnames, csv_row))
+                if len(csv_row) < num_fields:
+                    for fieldname in fieldnames[len(csv_row) :]:
+                        row_as_dict[fieldname] = None
+                elif len(csv_row) > num_fields:
+                    row_as_dict[None] = csv_row[num_fields:]
+                result[csv_row_number] = row_as_dict
+            if csv_row_number == last_row_number:
+                break
 
     return result
 
 
 def read_csv_as_dict_pd(csv_path):
-    result = pd.read_csv(csv_path)
-    cols_row = pd.DataFrame({col: [col] for col in result.columns})
-    result = pd.concat([cols_row, result]).reset_index().transpose()
-    result = result.drop("index").to_dict(orient="dict")
+    import pandas as pd
+
+    df = pd.read_csv(csv_path)
+    result = {0: {col: col for col in df.columns}}
+    result.update(enumerate(df.to_dict(orient="records"), start=1))
 
     return result
 
@@ -1100,12 +1237,15 @@ def normalize_string_path(path, current_dir):
     path = os.path.expanduser(path)
     if path[0] == ".":
         path = os.path.join(current_dir, path)
-    env_vars = ENV_VAR_RE.findall(path)
-    for env_var in env_vars:
+
+    def substitute_env_var(match):
+        env_var = match.group(1)
         assert (
             env_var in os.environ
         ), f"Environment variable {env_var} is not set."
-        path = path.replace(f"<${env_var}>", os.environ[env_var])
+        return os.environ[env_var]
+
+    path = ENV_VAR_RE.sub(substitute_env_var, path)
 
     return os.path.abspath(path)
 
@@ -1113,9 +1253,9 @@ def normalize_string_path(path, current_dir):
 def normalize_path(path, current_dir=None):
     if path is None:
         return None
-    if path.startswith(SKIP_NORMALIZATION_PREFIX):
-        return path[len(SKIP_NORMALIZATION_PREFIX):]
     if isinstance(path, str):
+        if path.startswith(SKIP_NORMALIZATION_PREFIX):
+            return path[len(SKIP_NORMALIZATION_PREFIX):]
         assert path
         return normalize_string_path(path, current_dir)
     elif isinstance(path, list):
@@ -1163,31 +1303,44 @@ def bootstrap_by_key_subname(input_dict, subname_to_bootstrap):
             "a": 1,
             "b": 3
         }
+
+    Returns the first key of <input_dict> which contains
+    <subname_to_bootstrap> or None, so that every dict is scanned only once.
     """
     new_key_values = []
+    key_of_interest = None
     for key, value in input_dict.items():
+        if (
+            key_of_interest is None
+            and isinstance(key, str)
+            and subname_to_bootstrap in key
+        ):
+            key_of_interest = key
         if isinstance(value, dict):
-            bootstrap_by_key_subname(value, subname_to_bootstrap)
-            key_of_interest = find_by_subkey(value.keys(), subname_to_bootstrap)
-            if key_of_interest is not None:
-                new_key_values.append((key, value[key_of_interest]))
+            value_key_of_interest = bootstrap_by_key_subname(
+                value, subname_to_bootstrap
+            )
+            if value_key_of_interest is not None:
+                new_key_values.append((key, value[value_key_of_interest]))
     for key, new_value in new_key_values:
         input_dict[key] = new_value
+    return key_of_interest
 
 
 def find_by_subkey(
     iterable, subkey, assert_found=False, only_first_occurence=True
 ):
-    result = []
-    for key in iterable:
-        if isinstance(key, str) and subkey in key:
-            if only_first_occurence:
-                return key
-            else:
-                result.append(key)
-
-    if len(result) > 0:
-        return result
+    matching_keys = (
+        key for key in iterable if isinstance(key, str) and subkey in key
+    )
+    if only_first_occurence:
+        first_key = next(matching_keys, None)
+        if first_key is not None:
+            return first_key
+    else:
+        result = list(matching_keys)
+        if len(result) > 0:
+            return result
 
     if assert_found:
         assert False, "Key with subkey {} wasn't found in {}.".format(
@@ -1197,6 +1350,7 @@ def find_by_subkey(
     return None
 
 
+@functools.lru_cache(maxsize=1)
 def get_system_root_path():
     return os.path.abspath(os.sep)
 
@@ -1313,11 +1467,32 @@ def kill_processes(processes_to_kill, logger=None):
 # def read_model_from_old_checkpoint(path):
 
 
+# one (reentrant) lock object per lock file,
+# so that all make_file_lock calls within a process share it,
+# entries go away once nobody references the lock,
+# {(pid, lock path): lock}
+FILE_LOCKS = weakref.WeakValueDictionary()
+
+
 def make_file_lock(file_name):
-    return FileLock("{}.lock".format(file_name))
+    lock_path = os.path.abspath("{}.lock".format(file_name))
+    # forked processes should not reuse locks of their parent,
+    # inherited lock counters would let them skip taking the lock
+    pid = os.getpid()
+    key = (pid, lock_path)
+    file_lock = FILE_LOCKS.get(key)
+    if file_lock is None:
+        # drop locks that a forked child inherited from its parent
+        stale_keys = [other for other in FILE_LOCKS.keys() if other[0] != pid]
+        for stale_key in stale_keys:
+            FILE_LOCKS.pop(stale_key, None)
+        file_lock = FILE_LOCKS.setdefault(key, FileLock(lock_path))
+    return file_lock
 
 
 def check_duplicates(input_list):
+    if len(set(input_list)) == len(input_list):
+        return
     counter_dict = dict(Counter(input_list))
     duplicate_dict = {
         key: value for key, value in counter_dict.items() if value > 1
@@ -1345,33 +1520,40 @@ class AttrDict(dict):
         self[key] = value
 
     def __deepcopy__(self, memo):
-        # Create a deepcopy of the object and its nested elements
-        copied = AttrDict()
-        for key, value in self.items():
-            copied[key] = copy.deepcopy(value, memo)
+        # Create a deepcopy of the object and its nested elements,
+        # __init__ is skipped as nested dicts are already AttrDicts,
+        # copy is put into memo first for self-referencing dicts
+        copied = AttrDict.__new__(AttrDict)
+        memo[id(self)] = copied
+        copied.update(
+            (key, copy.deepcopy(value, memo)) for key, value in self.items()
+        )
         return copied
 
 
 def has_nested_attr(object, nested_attr):
     assert len(nested_attr) > 0
-    if isinstance(object, dict):
-        object = AttrDict(object)
-    if len(nested_attr) == 1:
-        return hasattr(object, nested_attr[0])
-    else:
-        return hasattr(object, nested_attr[0]) and has_nested_attr(
-            getattr(object, nested_attr[0]), nested_attr[1:]
-        )
+    for attr in nested_attr:
+        if isinstance(object, dict):
+            if attr not in object:
+                return False
+            object = object[attr]
+        elif hasattr(object, attr):
+            object = getattr(object, attr)
+        else:
+            return False
+    return True
 
 
 def get_nested_attr(object, nested_attr):
     assert len(nested_attr) > 0
-    if isinstance(object, dict):
-        object = AttrDict(object)
-    if len(nested_attr) == 1:
-        return getattr(object, nested_attr[0])
-    else:
-        return get_nested_attr(getattr(object, nested_attr[0]), nested_attr[1:])
+    # dicts are indexed directly instead of being wrapped into AttrDicts
+    for attr in nested_attr:
+        if isinstance(object, dict):
+            object = object[attr]
+        else:
+            object = getattr(object, attr)
+    return object
 
 
 def set_nested_attr(object, nested_attr, value):
@@ -1388,26 +1570,37 @@ def set_nested_attr(object, nested_attr, value):
 
 
 def write_csv_dict_to_csv(dict_from_csv, csv_file, **kwargs):
-    if os.path.exists(csv_file):
-        remove_file_or_folder(csv_file)
-
-    touch_file(csv_file)
+    # rows are built in memory by the same rules
+    # as in write_into_csv_with_column_names and written at once
+    csv_dialect = dict(
+        delimiter=DELIMETER,
+        quotechar=QUOTE_CHAR,
+        quoting=csv.QUOTE_NONE,
+        escapechar=ESCAPE_CHAR,
+        doublequote=True,
+    )
+    csv_dialect.update(kwargs)
 
+    rows = []
     for row_number, row_as_dict in dict_from_csv.items():
         if row_number == 0:
             continue
         for i, (column_name, value) in enumerate(row_as_dict.items()):
-            write_into_csv_with_column_names(
-                csv_file,
+            insert_into_csv_rows(
+                rows,
                 row_number,
                 column_name,
                 value,
                 append_row=(i == 0),
-                **kwargs,
+                file_path=csv_file,
             )
 
+    write_csv_rows(csv_file, rows, **csv_dialect)
+
 
 def write_csv_dict_to_csv_pd(dict_from_csv, csv_file):
+    import pandas as pd
+
     df = pd.DataFrame.from_dict(dict_from_csv, orient="index")
     df = df.iloc[1:]
     df.to_csv(csv_file, index=False)
@@ -1444,19 +1637,20 @@ def expand_csv(
             end = range_as_str_split[1]
             step = range_as_str_split[2]
             log_scale = range_as_str_split[3]
-            result = []
-
             assert (
                 step > 1 if log_scale else step > 0
             ), "Range should be increasing"
 
+            if not log_scale:
+                # elements are computed as start + i * step,
+                # so float steps do not accumulate rounding errors
+                result = np.arange(start, end, step)
+                return result[result < end].tolist()
+
+            result = []
             while start < end:
                 result.append(start)
-
-                if log_scale:
-                    start *= step
-                else:
-                    start += step
+                start *= step
 
             return result
 
@@ -1498,33 +1692,41 @@ def expand_csv(
             else:
                 row_as_dict[key] = [value]
 
-        cross_product = itertools.product(*[row_as_dict[key] for key in keys])
-
-        result = []
-        for values in cross_product:
-            result.append({key: value for key, value in zip(keys, values)})
-
-        return result
-
-    dict_to_expand = read_csv_as_dict(csv_to_expand)
-    expanded_dict = {}
-    final_row_id = 0
-
-    for row_as_dict in dict_to_expand.values():
-        expanded_rows = expand_row(
-            row_as_dict,
-            expansion_start_symbol=expansion_start_symbol,
-            expansion_end_symbol=expansion_end_symbol,
-            expansion_delimeter=expansion_delimeter,
-            range_start_symbol=range_start_symbol,
-            range_end_symbol=range_end_symbol,
-            range_delimeter=range_delimeter,
+        for values in itertools.product(*[row_as_dict[key] for key in keys]):
+            yield dict(zip(keys, values))
+
+    def make_csv_rows(dict_to_expand):
+        expanded_rows = itertools.chain.from_iterable(
+            expand_row(
+                row_as_dict,
+                expansion_start_symbol=expansion_start_symbol,
+                expansion_end_symbol=expansion_end_symbol,
+                expansion_delimeter=expansion_delimeter,
+                range_start_symbol=range_start_symbol,
+                range_end_symbol=range_end_symbol,
+                range_delimeter=range_delimeter,
+            )
+            for row_as_dict in dict_to_expand.values()
         )
-        for row in expanded_rows:
-            expanded_dict[final_row_id] = row
-            final_row_id += 1
-
-    write_csv_dict_to_csv(expanded_dict, expanded_csv)
+        # as in write_csv_dict_to_csv the expanded header row is skipped,
+        # column names are taken from the keys of the first written row
+        next(expanded_rows, None)
+        for i, row in enumerate(expanded_rows):
+            if i == 0:
+                yield list(row.keys())
+            yield list(row.values())
+
+    # expanded rows are generated and written one by one
+    # instead of being collected in memory first
+    write_csv_rows(
+        expanded_csv,
+        make_csv_rows(read_csv_as_dict(csv_to_expand)),
+        delimiter=DELIMETER,
+        quotechar=QUOTE_CHAR,
+        quoting=csv.QUOTE_NONE,
+        escapechar=ESCAPE_CHAR,
+        doublequote=True,
+    )
 
 
 def instantiate_from_config(config, object_key_in_config, make_func, logger):
@@ -1715,23 +1917,23 @@ def prune_list(l, value):
 def get_with_assert(container, key, error_msg=None):
     if isinstance(key, list):
         assert len(key) > 0
-        next_key = key[0]
-        rest_key = key[1:]
-        next_container = get_with_assert(container, next_key, error_msg)
-        if len(rest_key) == 0:
-            return next_container
-        else:
-            return get_with_assert(next_container, rest_key, error_msg)
+        for next_key in key:
+            container = get_with_assert(container, next_key, error_msg)
+        return container
+
+    # one lookup instead of "in" followed by indexing
+    if isinstance(container, dict):
+        value = container.get(key, KEY_NOT_FOUND)
     else:
-        key_in_container = key in container
+        value = container[key] if key in container else KEY_NOT_FOUND
 
-        if not key_in_container:
-            if error_msg is None:
-                error_msg = f'Key "{key}" not in container: {container}'
+    if value is KEY_NOT_FOUND:
+        if error_msg is None:
+            error_msg = f'Key "{key}" not in container: {container}'
 
-            raise Exception(error_msg)
+        raise Exception(error_msg)
 
-        return container[key]
+    return value
 
 
 def properties_diff(first_object, second_object, only_local=True):
@@ -1759,47 +1961,86 @@ def get_even_from_wrapped(giver, wrappable_as_property, property_to_get):
 
 
 def add_custom_properties(giver, taker, only_local=True):
+    if only_local:
+        # single walk over the giver's attributes without building sets,
+        # setattr is kept for takers with custom __setattr__ (e.g. modules)
+        taker_properties = taker.__dict__
+        for custom_property, value in list(giver.__dict__.items()):
+            if custom_property not in taker_properties:
+                setattr(taker, custom_property, value)
+        return
+
     custom_properties = properties_diff(giver, taker, only_local=only_local)
     for custom_property in custom_properties:
         setattr(taker, custom_property, getattr(giver, custom_property))
 
 
 def invert_dict(d, none_to_string=False):
-    res = {}
-    for key, container in d.items():
-        assert isinstance(container, Iterable)
-        for value in container:
-            if none_to_string and value is None:
-                value = "None"
-            assert value not in res, f"Dict is not invertible: {d}"
-            res[value] = key
+    pairs = [
+        ("None" if none_to_string and value is None else value, key)
+        for key, container in d.items()
+        for value in container
+    ]
+    res = dict(pairs)
+    # repeated values collapse into one key
+    assert len(res) == len(pairs), f"Dict is not invertible: {d}"
     return res
 
 
 def load_from_pickle(path):
-    return pickle.load(open(path, "rb"))
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+# same parts as input_string.split(separator), without building the list
+def iter_split(input_string, separator):
+    # checked before creating the generator to fail on call like str.split
+    if separator == "":
+        raise ValueError("empty separator")
+
+    def split_generator():
+        start = 0
+        while True:
+            end = input_string.find(separator, start)
+            if end == -1:
+                yield input_string[start:]
+                return
+            yield input_string[start:end]
+            start = end + len(separator)
+
+    return split_generator()
 
 
 def extract_list_from_huge_string(huge_string, separator="\n"):
     assert isinstance(huge_string, str)
-    split = huge_string.split(separator)
-    res = []
-    for el in split:
-        el = el.strip()
-        if el != "":
-            res.append(el)
-    return res
+    # parts are stripped as they are found,
+    # without building the list of all unstripped parts first
+    return [
+        el
+        for el in map(str.strip, iter_split(huge_string, separator))
+        if el != ""
+    ]
 
 
-def apply_pairwise(iterable, func):
+def apply_pairwise(iterable, func, vectorized=False):
+    """
+    Apply <func> to all pairs of elements of <iterable>
+    in the order of itertools.combinations.
+
+    If <vectorized> is True, <func> is called only once
+    with two NumPy arrays holding the first and the second elements
+    of all pairs, e.g. func=np.subtract or
+    func=lambda a, b: np.linalg.norm(a - b, axis=-1).
+    """
     if len(iterable) == 1:
         return iterable
 
-    pairs = itertools.combinations(iterable, 2)
-    res = []
-    for a, b in pairs:
-        res.append(func(a, b))
-    return res
+    if vectorized:
+        array = np.asarray(iterable)
+        first_ids, second_ids = np.triu_indices(len(array), k=1)
+        return func(array[first_ids], array[second_ids]).tolist()
+
+    return [func(a, b) for a, b in itertools.combinations(iterable, 2)]
 
 
 # def download_file(file_path, download_url):
@@ -1899,5 +2140,7 @@ def optionally_make_parent_dir(path, call_dirname=True):
         base_dir = os.path.dirname(path)
     else:
         base_dir = path
-    if base_dir != "":
+    # single stat for the common case of an existing dir,
+    # makedirs would also try to create it and handle the error
+    if base_dir != "" and not os.path.isdir(base_dir):
         os.makedirs(base_dir, exist_ok=True)
@@ -1,17 +1,12 @@
-import random
+import numpy as np
 import sys
 import os
 import logging
 
 
 # local imports
-sys.path.insert(
-    0,
-    os.path.dirname(os.path.dirname(__file__)),
-)
-from test_main import STND_ROOT
-
-sys.path.pop(0)
+CUR_FOLDER = os.path.dirname(os.path.abspath(__file__))
+STND_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(CUR_FOLDER)))
 
 sys.path.insert(
     0,
@@ -36,10 +31,7 @@ def demo_experiment(
 ):
     image_size = experiment_config["image"]["shape"]
 
-    colored_image = [
-        [0 for _ in range(image_size[1])] for _ in range(image_size[0])
-    ]
-    colored_image = [colored_image for _ in range(3)]
+    colored_image = np.zeros((3, image_size[0], image_size[1]))
 
     if experiment_config["image"]["color"] == "red":
         channel = 0
@@ -47,26 +39,19 @@ def demo_experiment(
         channel = 2
 
     init_type = experiment_config["initialization_type"]
+    assert init_type in ("random", "zeros", "ones")
+
+    # image is allocated with zeros and constant channels are filled once,
+    # only random values change between iterations
+    if init_type == "ones":
+        colored_image[channel].fill(1)
 
     for i in range(10):
         if init_type == "random":
-            colored_image[channel] = [
-                [random.random() for _ in range(image_size[1])]
-                for _ in range(image_size[0])
-            ]
-        elif init_type == "zeros":
-            colored_image[channel] = [
-                [0 for _ in range(image_size[1])] for _ in range(image_size[0])
-            ]
-        else:
-            assert init_type == "ones"
-            colored_image[channel] = [
-                [1 for _ in range(image_size[1])] for _ in range(image_size[0])
-            ]
-
-        mean = sum(
-            sum(sum(row) for row in channel) for channel in colored_image
-        ) / (image_size[0] * image_size[1] * 3)
+            colored_image[channel] = np.random.random(image_size)
+
+        # other channels are zeros, so only the filled one is reduced
+        mean = float(colored_image[channel].mean()) / len(colored_image)
 
         # log latest mean in csv
         try_to_log_in_csv(logger, "mean of latest tensor", mean)
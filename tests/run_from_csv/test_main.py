@@ -1,13 +1,16 @@
+import contextlib
+import csv
+import functools
+import io
 import os
+import re
 import tempfile
 import shutil
 import pytest
 import yaml
-import pandas as pd
 import sys
 import subprocess
 import time
-import numpy as np
 
 
 # local imports
@@ -18,6 +21,7 @@ sys.path.insert(
     STND_ROOT,
 )
 from stnd.utility.utils import (
+    YAML_DUMPER,
     optionally_make_parent_dir,
     run_cmd_through_popen,
 )
@@ -28,12 +32,17 @@ sys.path.pop(0)
 
 
 UNIQUE_COLUMNS = ["run_folder", "walltime"]
+# random suffix of the temporary folder and name of the autogenerated config,
+# group names are used as placeholders in canonical submission files
+SUBMISSION_PLACEHOLDERS_RE = re.compile(
+    r"(?<=/run_from_csv)(?P<hash>[^/\s]+)(?=/)"
+    r"|(?<=/autogenerated/)(?P<autogenerated_config>[^/\s]+?)(?=\.yaml)"
+)
 DEFAULT_PLACEHOLDER = PLACEHOLDERS_FOR_DEFAULT[0]
 TOTAL_ROWS = 3
 RUNNER_ROWS = 2
-MAX_SLEEPS = 100
-SMALL_SLEEP_TIME = 1
-SLEEP_TIME = 5
+MAX_WAIT_TIME = 500
+STATUS_POLL_TIME = 0.05
 # SKIP_TESTS = True
 SKIP_TESTS = False
 
@@ -43,8 +52,9 @@ EXECUTABLES_FOLDER = os.path.join(CUR_FOLDER, "executables")
 CONFIGS_FOLDER = os.path.join(CUR_FOLDER, "configs")
 
 
-def create_test_csv(csv_path, config_path, cluster_type="slurm"):
-    """Create a test CSV file with minimal required columns."""
+@functools.lru_cache(maxsize=None)
+def make_test_csv_contents(config_path, cluster_type):
+    """Serialize the test CSV once per config path and cluster type."""
     path_to_main = os.path.join(EXECUTABLES_FOLDER, "executable.py")
     path_to_runner_target = os.path.join(EXECUTABLES_FOLDER, "runner_target.py")
     if cluster_type == "slurm":
@@ -98,13 +108,21 @@ def create_test_csv(csv_path, config_path, cluster_type="slurm"):
     else:
         raise ValueError(f"Invalid cluster type: {cluster_type}")
 
-    df = pd.DataFrame(data)
-    df.to_csv(csv_path, index=False)
+    contents = io.StringIO()
+    writer = csv.writer(contents, lineterminator="\n")
+    writer.writerow(data.keys())
+    writer.writerows(zip(*data.values()))
+    return contents.getvalue()
 
 
-def create_test_config(config_path):
-    """Create a test config file."""
-    config = {
+def create_test_csv(csv_path, config_path, cluster_type="slurm"):
+    """Create a test CSV file with minimal required columns."""
+    with open(csv_path, "w", newline="") as f:
+        f.write(make_test_csv_contents(config_path, cluster_type))
+
+
+TEST_CONFIG_CONTENTS = yaml.dump(
+    {
         "initialization_type": 1,
         "image": {"shape": [64, 64], "color": "red"},
         "params": {"random_seed": 42},
@@ -115,14 +133,20 @@ def create_test_config(config_path):
             "use_tb": False,
         },
         "use_hardcoded_config": False,
-    }
+    },
+    Dumper=YAML_DUMPER,
+)
+
+
+def create_test_config(config_path):
+    """Create a test config file."""
     with open(config_path, "w") as f:
-        yaml.dump(config, f)
+        f.write(TEST_CONFIG_CONTENTS)
 
 
-@pytest.fixture
-def test_env(request):
-    """Set up test environment with temporary files."""
+@pytest.fixture(scope="module")
+def shared_test_env(request):
+    """Set up temporary folder shared by all tests in this module."""
     with tempfile.TemporaryDirectory(prefix=CUR_FOLDER) as temp_dir:
         # Create symlink to parent repo's .git directory so git commands work
         # git diff in logs will show that all the files are deleted
@@ -132,19 +156,6 @@ def test_env(request):
         os.symlink(parent_git_dir, os.path.join(temp_dir, ".git"))
 
         os.environ["PROJECT_ROOT_PROVIDED_FOR_STUNED"] = temp_dir
-        # Create test files
-        csv_path = os.path.join(temp_dir, "test.csv")
-        csv_path_runner = os.path.join(temp_dir, "test_runner.csv")
-        csv_path_condor = os.path.join(temp_dir, "test_condor.csv")
-        config_path = os.path.join(CONFIGS_FOLDER, "config.yaml")
-        config_path_runner = os.path.join(CONFIGS_FOLDER, "runner_config.yaml")
-
-        # optionally can create config inplace: create_test_config(config_path)
-        create_test_csv(csv_path, config_path)
-        create_test_csv(
-            csv_path_runner, config_path_runner, cluster_type="runner"
-        )
-        create_test_csv(csv_path_condor, config_path, cluster_type="condor")
 
         # Create necessary directories
         os.makedirs(os.path.join(temp_dir, "experiment_configs"), exist_ok=True)
@@ -152,10 +163,10 @@ def test_env(request):
 
         env_dict = {
             "temp_dir": temp_dir,
-            "csv_path": csv_path,
-            "csv_path_runner": csv_path_runner,
-            "csv_path_condor": csv_path_condor,
-            "config_path": config_path,
+            "csv_path": os.path.join(temp_dir, "test.csv"),
+            "csv_path_runner": os.path.join(temp_dir, "test_runner.csv"),
+            "csv_path_condor": os.path.join(temp_dir, "test_condor.csv"),
+            "config_path": os.path.join(CONFIGS_FOLDER, "config.yaml"),
         }
 
         yield env_dict
@@ -163,6 +174,28 @@ def test_env(request):
         request.addfinalizer(lambda: cleanup_test_env(env_dict))
 
 
+@pytest.fixture
+def test_env(shared_test_env):
+    """Set up test environment with fresh test files."""
+    # test files are recreated for each test,
+    # because running them updates their status columns
+    config_path = shared_test_env["config_path"]
+    config_path_runner = os.path.join(CONFIGS_FOLDER, "runner_config.yaml")
+
+    # optionally can create config inplace: create_test_config(config_path)
+    create_test_csv(shared_test_env["csv_path"], config_path)
+    create_test_csv(
+        shared_test_env["csv_path_runner"],
+        config_path_runner,
+        cluster_type="runner",
+    )
+    create_test_csv(
+        shared_test_env["csv_path_condor"], config_path, cluster_type="condor"
+    )
+    return shared_test_env
+
+
+@functools.lru_cache(maxsize=None)
 def get_python_binary():
     # on github everything is in the base env, but when debugging
     # we need to use the envs/stnd_env env
@@ -209,13 +242,13 @@ def test_runner_script(test_env):
         "--log_file_path",
         log_file_path,
     ]
-    df = compare_csv_to_canonical(
+    rows = compare_csv_to_canonical(
         cmd,
         log_file_path,
         test_env["csv_path_runner"],
         os.path.join(CANONICAL_FOLDER, "canonical_csv_runner.csv"),
     )
-    run_folder = df["run_folder"].iloc[0]
+    run_folder = rows[0]["run_folder"]
     stdout_path = os.path.join(test_env["temp_dir"], run_folder, "stdout.txt")
     stderr_path = os.path.join(test_env["temp_dir"], run_folder, "stderr.txt")
     stdout = read_last_bytes(stdout_path)
@@ -224,10 +257,18 @@ def test_runner_script(test_env):
     assert "Hello, stderr" in stderr, "Hello, stderr not found"
 
 
-def compare_csv_to_canonical(cmd, log_file_path, df_path, canonical_df_path):
-    # Run the command and check for errors
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    time.sleep(SMALL_SLEEP_TIME)  # make sure that status column is created
+def read_csv_rows(csv_path):
+    """Read csv rows as dicts with cells exactly as they are written."""
+    with open(csv_path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def compare_csv_to_canonical(cmd, log_file_path, csv_path, canonical_csv_path):
+    # Run the command and check for errors,
+    # stdout is not checked here, it is written to the log file anyway
+    result = subprocess.run(
+        cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
 
     # Check that the script ran successfully
     assert result.returncode == 0, f"Script failed with error: {result.stderr}"
@@ -235,54 +276,48 @@ def compare_csv_to_canonical(cmd, log_file_path, df_path, canonical_df_path):
     # Check that the output file was created
     assert os.path.exists(log_file_path), "Log file was not created"
 
-    # Check that the CSV was updated
-    df = pd.read_csv(df_path)
-    num_sleeps = 0
+    # Check that the CSV was updated,
+    # status column is written before the command returns
+    deadline = time.monotonic() + MAX_WAIT_TIME
     while (
-        df["status"].iloc[0] in ["Submitted", "Running"]
-        and num_sleeps < MAX_SLEEPS
+        any(
+            row["status"] in ("Submitted", "Running")
+            for row in read_csv_rows(csv_path)
+        )
+        and time.monotonic() < deadline
     ):
         # Wait a bit for the job to complete
-        time.sleep(SLEEP_TIME)
-        df = pd.read_csv(df_path)
-        num_sleeps += 1
-    assert df["status"].iloc[0] == "Completed", "CSV status was not updated"
+        time.sleep(STATUS_POLL_TIME)
+    rows = read_csv_rows(csv_path)
+    assert rows[0]["status"] == "Completed", "CSV status was not updated"
 
     # Load canonical CSV for comparison
-    canonical_df = pd.read_csv(canonical_df_path)
+    canonical_rows = read_csv_rows(canonical_csv_path)
 
-    # Check that all expected columns exist in both dataframes
-    assert set(canonical_df.columns) == set(
-        df.columns
+    # Check that all expected columns exist in both csvs
+    assert set(canonical_rows[0]) == set(
+        rows[0]
     ), "CSV columns do not match canonical CSV"
 
     # Check run_folder column exists and contains string
     for col in UNIQUE_COLUMNS:
-        assert col in df.columns, f"{col} column missing"
-        assert isinstance(df[col].iloc[0], str), f"{col} value is not a string"
+        assert col in rows[0], f"{col} column missing"
+        assert isinstance(rows[0][col], str), f"{col} value is not a string"
 
     # Compare all columns except run_folder
     cols_to_compare = [
-        col for col in canonical_df.columns if col not in UNIQUE_COLUMNS
+        col for col in canonical_rows[0] if col not in UNIQUE_COLUMNS
     ]
-    for col in cols_to_compare:
-        for row in range(canonical_df.shape[0]):
-            value_in_df = df[col].iloc[row]
-            if isinstance(value_in_df, str):
-                value_in_df = value_in_df.replace(CUR_FOLDER, ".")
-            canonical_value = canonical_df[col].iloc[row]
-            if not isinstance(canonical_value, str) and np.isnan(
-                canonical_value
-            ):
-                assert np.isnan(
-                    value_in_df
-                ), f"Value in column {col} should be NaN"
-            else:
-                assert (
-                    value_in_df == canonical_value
-                ), f"Column {col} does not match canonical CSV"
+    assert len(rows) == len(
+        canonical_rows
+    ), "Number of rows does not match canonical CSV"
+    for row, canonical_row in zip(rows, canonical_rows):
+        for col in cols_to_compare:
+            assert (
+                row[col].replace(CUR_FOLDER, ".") == canonical_row[col]
+            ), f"Column {col} does not match canonical CSV"
 
-    return df
+    return rows
 
 
 @pytest.mark.skipif(SKIP_TESTS, reason="Skip tests when debugging")
@@ -306,13 +341,13 @@ def test_main_script(test_env):
         log_file_path,
     ]
 
-    df = compare_csv_to_canonical(
+    rows = compare_csv_to_canonical(
         cmd,
         log_file_path,
         test_env["csv_path"],
         os.path.join(CANONICAL_FOLDER, "canonical_csv.csv"),
     )
-    run_folder = df["run_folder"].iloc[0]
+    run_folder = rows[0]["run_folder"]
     stdout_path = os.path.join(test_env["temp_dir"], run_folder, "stdout.txt")
     stderr_path = os.path.join(test_env["temp_dir"], run_folder, "stderr.txt")
     stdout = read_last_bytes(stdout_path)
@@ -410,9 +445,6 @@ def test_condor_scripts(test_env):
 
 
 def check_submission_script(cmd, cluster_type):
-    # Run the command and check for errors
-    result = subprocess.run(cmd, capture_output=True, text=True)
-
     if cluster_type == "condor":
         canonical_path = os.path.join(CANONICAL_FOLDER, f"canonical_condor.txt")
     else:
@@ -429,8 +461,14 @@ def check_submission_script(cmd, cluster_type):
         canonical_contents_sh_file = None
 
     condor_executable_path = None
-    for line in result.stdout.split("\n"):
-        if "COMMAND TO SUBMIT" in line:
+    # Run the command and check submission scripts as soon as they are printed
+    with subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+    ) as process:
+        for line in process.stdout:
+            line = line.rstrip("\n")
+            if "COMMAND TO SUBMIT" not in line:
+                continue
             if cluster_type == "condor":
                 submission_file = line.split("condor_submit_bid ")[-1].split(
                     " "
@@ -458,13 +496,6 @@ def check_submission_script(cmd, cluster_type):
                 canonical_contents = canonical_contents_sh_file
 
             else:
-                # Replace random temp folder hash with generic <hash> placeholder
-                tmp_hash = submission_contents.split("/run_from_csv", 1)[
-                    -1
-                ].split("/")[0]
-                submission_contents = submission_contents.replace(
-                    tmp_hash, "<hash>"
-                )
                 before_python = None
                 for line in submission_contents.split("\n"):
                     if "python " in line:
@@ -473,12 +504,11 @@ def check_submission_script(cmd, cluster_type):
                 submission_contents = submission_contents.replace(
                     before_python, ""
                 )
-            autogen_config = submission_contents.split("autogenerated/")[
-                -1
-            ].split(".yaml")[0]
+            # Replace temp folder hash and autogenerated config name
+            # with generic placeholders
             submission_contents = (
-                submission_contents.replace(
-                    autogen_config, "<autogenerated_config>"
+                SUBMISSION_PLACEHOLDERS_RE.sub(
+                    lambda match: f"<{match.lastgroup}>", submission_contents
                 ).replace(STND_ROOT, ".")
                 + "\n"
             )
@@ -494,17 +524,16 @@ def check_submission_script(cmd, cluster_type):
 def cleanup_test_env(test_env):
     """Clean up test environment after tests complete."""
     # Remove temporary directory and all contents
-    if os.path.exists(test_env["temp_dir"]):
-        shutil.rmtree(test_env["temp_dir"])
+    shutil.rmtree(test_env["temp_dir"], ignore_errors=True)
 
     # Remove any generated CSV files
-    if os.path.exists(test_env["csv_path"]):
+    with contextlib.suppress(FileNotFoundError):
         os.remove(test_env["csv_path"])
 
     # Clean up any autogenerated folders
-    autogen_path = os.path.join(CONFIGS_FOLDER, "autogenerated")
-    if os.path.exists(autogen_path):
-        shutil.rmtree(autogen_path)
+    shutil.rmtree(
+        os.path.join(CONFIGS_FOLDER, "autogenerated"), ignore_errors=True
+    )
 
 
 @pytest.mark.skipif(SKIP_TESTS, reason="Skip tests when debugging")
@@ -0,0 +1,505 @@
+import pytest
+import sys
+import os
+import csv
+import io
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+# Add the project root to the path so we can import the modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from stnd.utility.logger import (
+    GspreadClient,
+    RedneckLogger,
+    TeeStd,
+    extract_csv_name_from_path,
+    extract_id_from_gdrive_url,
+    extract_id_from_spreadsheet_url,
+    make_gdrive_client,
+    make_gspread_client,
+    make_progress_bar,
+    read_csv_as_list,
+    try_to_log_in_csv,
+    try_to_log_in_csv_in_batch,
+)
+from stnd.utility.utils import make_file_lock, read_csv_as_dict
+
+
+class TestRedneckLoggerOutputFiles:
+    """Test that RedneckLogger writes its output files"""
+
+    def test_log_without_std_capture(self, tmp_path):
+        """Test that log lines reach stdout.txt when std is not captured"""
+        logger = RedneckLogger(str(tmp_path), capture_std=False)
+        assert logger.stdout_lock is not None
+        assert logger.stderr_lock is not None
+
+        logger.log("some message")
+        logger.error("some error")
+
+        assert "(log): some message\n" in (tmp_path / "stdout.txt").read_text()
+        assert "(error): some error\n" in (tmp_path / "stderr.txt").read_text()
+
+
+class TestGdriveDaemon:
+    """Test the thread that syncs output files with gdrive"""
+
+    def test_daemon_stops_on_event(self, tmp_path, monkeypatch):
+        """Test that the daemon uses its own client and stops cleanly"""
+        created_in_threads = []
+        synced_with = []
+
+        def fake_make_gdrive_client(logger, use_cache=True):
+            assert not use_cache
+            created_in_threads.append(threading.get_ident())
+            return MagicMock()
+
+        def fake_sync(logger, gdrive_client=None):
+            synced_with.append((threading.get_ident(), gdrive_client))
+
+        monkeypatch.setattr(
+            "stnd.utility.logger.make_gdrive_client", fake_make_gdrive_client
+        )
+        monkeypatch.setattr(
+            "stnd.utility.logger.sync_output_with_remote", fake_sync
+        )
+        logger = RedneckLogger(str(tmp_path), capture_std=False)
+        logger.remote_stdout_url = "stdout url"
+        logger.remote_stderr_url = "stderr url"
+
+        logger.start_gdrive_daemon(sync_time=0.01)
+        daemon = logger.gdrive_daemon
+        deadline = time.monotonic() + 10
+        while not synced_with and time.monotonic() < deadline:
+            time.sleep(0.01)
+        logger.stop_gdrive_daemon()
+
+        assert not daemon.is_alive()
+        assert logger.gdrive_daemon is None
+        assert created_in_threads == [daemon.ident]
+        assert synced_with[0][0] == daemon.ident
+        assert synced_with[0][1] is not None
+        # final sync happens in the stopping thread with its own client
+        assert synced_with[-1] == (threading.get_ident(), None)
+
+    def test_uncached_client_is_not_stored(self, monkeypatch):
+        """Test that clients created with use_cache=False bypass the cache"""
+        monkeypatch.setattr(
+            "stnd.utility.logger.GdriveClient._create_client",
+            lambda self: MagicMock(),
+        )
+        clients = {}
+        monkeypatch.setattr("stnd.utility.logger.GOOGLE_CLIENTS", clients)
+
+        first = make_gdrive_client(None, use_cache=False)
+        second = make_gdrive_client(None, use_cache=False)
+
+        assert first.client is not second.client
+        assert clients == {}
+        assert (
+            make_gdrive_client(None).client is make_gdrive_client(None).client
+        )
+        assert len(clients) == 1
+
+
+class TestMakeLogMessage:
+    """Test formatting of log lines"""
+
+    def test_styled_message_is_wrapped_with_style_codes(self):
+        """Test that style codes count towards the wrapped line width"""
+        logger = RedneckLogger(capture_std=False)
+        msg = " ".join(["word"] * 18)
+
+        assert logger.make_log_message(
+            msg,
+            "prefix",
+            prefix_style_code="\x1b[1;32;40m",
+            message_style_code="\x1b[1;37;40m",
+            auto_newline=True,
+        ) == (
+            "\x1b[1;32;40mprefix: \x1b[1;37;40m"
+            + " ".join(["word"] * 10)
+            + "\n    "
+            + " ".join(["word"] * 8)
+            + "\x1b[0;37;40m"
+        )
+        assert logger.format_log_message(msg, "prefix", auto_newline=True) == (
+            "prefix: " + " ".join(["word"] * 14) + "\n    word word word word"
+        )
+
+
+class TestOutputFileLocksAfterFork:
+    """Test that forked children do not inherit held output file locks"""
+
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="Requires os.fork")
+    @pytest.mark.parametrize("use_file_lock", [False, True])
+    def test_fork_while_sync_thread_holds_lock(
+        self, tmp_path, monkeypatch, use_file_lock
+    ):
+        """Test that a child forked during a sync can still print"""
+        logger = RedneckLogger(
+            str(tmp_path), capture_std=False, use_file_lock=use_file_lock
+        )
+        monkeypatch.setattr(
+            sys,
+            "stdout",
+            TeeStd(io.StringIO(), logger.stdout_file, logger.stdout_lock),
+        )
+        lock_is_held = threading.Event()
+        release_lock = threading.Event()
+
+        def hold_lock_like_sync_thread():
+            with logger.stdout_lock:
+                lock_is_held.set()
+                release_lock.wait()
+
+        sync_thread = threading.Thread(target=hold_lock_like_sync_thread)
+        sync_thread.start()
+        lock_is_held.wait()
+        try:
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    # file locks are shared with the parent, so they are
+                    # taken once its sync thread releases them
+                    acquired = sys.stdout.file_lock.acquire(timeout=10)
+                    if acquired:
+                        sys.stdout.file_lock.release()
+                        print("from child")
+                    os._exit(0 if acquired else 1)
+                except BaseException:
+                    os._exit(2)
+        finally:
+            release_lock.set()
+            sync_thread.join()
+        _, status = os.waitpid(pid, 0)
+
+        assert os.waitstatus_to_exitcode(status) == 0
+        assert "from child\n" in (tmp_path / "stdout.txt").read_text()
+
+
+class TestRedneckProgressBar:
+    """Test RedneckProgressBar without a logger"""
+
+    def test_short_loop_prints_every_step(self, capsys):
+        """Test that all steps are printed when there are few of them"""
+        progress_bar = make_progress_bar(3, "loop")
+        for _ in range(3):
+            progress_bar.update()
+        assert capsys.readouterr().out == "loop: 1/3\nloop: 2/3\nloop: 3/3\n"
+
+    def test_logger_interval_is_computed_once(self, tmp_path):
+        """Test that the logger logs every 1% of steps plus first two"""
+        logger = RedneckLogger(str(tmp_path), capture_std=False)
+        progress_bar = make_progress_bar(1000, "loop", logger=logger)
+        assert progress_bar.log_every_n_steps == 10
+        for _ in range(1000):
+            progress_bar.update()
+        stdout = (tmp_path / "stdout.txt").read_text()
+        assert stdout.count("loop ") == 102
+        assert "loop 1000/1000: 100/100%..\n" in stdout
+
+    def test_long_loop_is_throttled(self, capsys):
+        """Test that long loops print at most ~1000 lines"""
+        progress_bar = make_progress_bar(10001, "loop")
+        for _ in range(10001):
+            progress_bar.update()
+        lines = capsys.readouterr().out.splitlines()
+        assert len(lines) <= 1001
+        assert lines[0] == "loop: 1/10001"
+        assert lines[-1] == "loop: 10001/10001"
+
+
+class TestTryToLogInCsv:
+    """Test deferred csv logging"""
+
+    def make_logger_with_csv(self, tmp_path):
+        csv_path = tmp_path / "output.csv"
+        csv_path.write_text("name,status\nfirst,?\n")
+        logger = RedneckLogger(str(tmp_path / "logs"), capture_std=False)
+        logger.set_csv_output(
+            {"path": str(csv_path), "row_number": 1, "spreadsheet_url": None}
+        )
+        return logger, str(csv_path)
+
+    def test_updates_are_written_on_flush(self, tmp_path):
+        """Test that logged values reach the csv only when flushed"""
+        logger, csv_path = self.make_logger_with_csv(tmp_path)
+
+        try_to_log_in_csv(logger, "status", "Running")
+        try_to_log_in_csv(logger, "new column", "value")
+        try_to_log_in_csv(logger, "status", "Completed")
+        assert read_csv_as_dict(csv_path)[1]["status"] == "?"
+
+        logger.flush_csv()
+        row = read_csv_as_dict(csv_path)[1]
+        assert row["status"] == "Completed"
+        assert row["new column"] == "value"
+        assert logger.pending_csv_updates == {}
+
+    def test_flush_argument(self, tmp_path):
+        """Test that flush=True writes the batch immediately"""
+        logger, csv_path = self.make_logger_with_csv(tmp_path)
+
+        try_to_log_in_csv_in_batch(logger, [("status", "Fail")], flush=True)
+        assert read_csv_as_dict(csv_path)[1]["status"] == "Fail"
+
+
+class TestExtractIdFromGdriveUrl:
+    """Test extract_id_from_gdrive_url function"""
+
+    @pytest.mark.parametrize(
+        "url,expected_id",
+        [
+            ("https://drive.google.com/open?id=abc-123_X", "abc-123_X"),
+            ("https://drive.google.com/file/d/F1le_id/view", "F1le_id"),
+            (
+                "https://drive.google.com/drive/folders/Fo1der-id?usp=sharing",
+                "Fo1der-id",
+            ),
+            ("https://example.com/?key=some.key&other=1", "some.key"),
+        ],
+    )
+    def test_known_url_formats(self, url, expected_id):
+        """Test that ids are extracted from all supported url formats"""
+        assert extract_id_from_gdrive_url(url) == expected_id
+
+    def test_resource_key_does_not_shadow_folder_id(self):
+        """Test that the first id in the url wins over a later resourcekey"""
+        url = "https://drive.google.com/drive/folders/Fo1der?resourcekey=0-x"
+        assert extract_id_from_gdrive_url(url) == "Fo1der"
+
+    def test_invalid_url(self):
+        """Test that urls without an id raise an exception"""
+        with pytest.raises(Exception, match="No valid key found"):
+            extract_id_from_gdrive_url("https://drive.google.com/drive/")
+
+
+class TestExtractIdFromSpreadsheetUrl:
+    """Test extract_id_from_spreadsheet_url function"""
+
+    @pytest.mark.parametrize(
+        "url,expected_id",
+        [
+            (
+                "https://docs.google.com/spreadsheets/d/Sheet-id_1/edit#gid=0",
+                "Sheet-id_1",
+            ),
+            (
+                "https://docs.google.com/spreadsheet/ccc?key=old.key#gid=0",
+                "old.key",
+            ),
+            (
+                "https://docs.google.com/spreadsheets/d/Sheet?resourcekey=0-x",
+                "Sheet",
+            ),
+        ],
+    )
+    def test_known_url_formats(self, url, expected_id):
+        """Test that ids are extracted from all supported url formats"""
+        assert extract_id_from_spreadsheet_url(url) == expected_id
+
+    def test_invalid_url(self):
+        """Test that urls without an id raise an exception"""
+        with pytest.raises(Exception, match="No valid key found"):
+            extract_id_from_spreadsheet_url("https://docs.google.com/")
+
+
+class TestExtractCsvNameFromPath:
+    """Test extract_csv_name_from_path function"""
+
+    def test_only_extension_is_removed(self):
+        """Test that ".csv" inside the name is kept"""
+        assert extract_csv_name_from_path("/tmp/x.csv/my.csv.csv") == "my.csv"
+
+    def test_not_csv(self):
+        """Test that paths without .csv extension are rejected"""
+        with pytest.raises(AssertionError):
+            extract_csv_name_from_path("/tmp/file.csv.bak")
+
+
+class TestReadCsvAsList:
+    """Test read_csv_as_list function"""
+
+    @pytest.mark.parametrize(
+        "contents",
+        [
+            "",
+            "a,b\n1,2\n",
+            "a,b\n\n1,\n,2",
+            'a,b\n"1,2",3\n',
+            'a,"multi\nline"\n',
+            "a,b\r\n1,2\r\n",
+        ],
+    )
+    def test_matches_csv_reader(self, tmp_path, contents):
+        """Test that the rows are the same as the ones from csv.reader"""
+        csv_path = tmp_path / "file.csv"
+        with open(csv_path, "w", newline="") as csv_file:
+            csv_file.write(contents)
+        with open(csv_path) as csv_file:
+            expected_rows = list(csv.reader(csv_file))
+
+        assert read_csv_as_list(str(csv_path)) == expected_rows
+        assert read_csv_as_list(str(csv_path), max_rows=1) == expected_rows[:1]
+
+
+class TestGspreadClient:
+    """Test that GspreadClient batches its spreadsheet requests"""
+
+    def test_google_client_is_created_once(self, monkeypatch):
+        """Test that the authenticated client is shared between clients"""
+        monkeypatch.setattr("stnd.utility.logger.GOOGLE_CLIENTS", {})
+        with patch.object(
+            GspreadClient, "_create_client", return_value=MagicMock()
+        ) as create_client:
+            first_client = make_gspread_client(None, "credentials.json")
+            second_client = make_gspread_client(None, "credentials.json")
+            other_client = make_gspread_client(None, "other.json")
+
+        assert first_client is not second_client
+        assert first_client.client is second_client.client
+        assert create_client.call_count == 2
+        assert other_client.client is create_client.return_value
+
+    def make_client_with_spreadsheet(self, worksheet_titles):
+        spreadsheet = MagicMock()
+        worksheets = []
+        for i, title in enumerate(worksheet_titles):
+            worksheet = MagicMock()
+            worksheet.title = title
+            worksheet.id = i
+            worksheets.append(worksheet)
+        spreadsheet.worksheets.return_value = worksheets
+
+        gspread_client = GspreadClient.__new__(GspreadClient)
+        gspread_client.logger = None
+        gspread_client.client = MagicMock()
+        gspread_client.worksheets_cache = {}
+        gspread_client.client.create.return_value = spreadsheet
+        gspread_client.client.open_by_url.return_value = spreadsheet
+        return gspread_client, spreadsheet
+
+    def make_csvs(self, tmp_path, names):
+        csv_files = []
+        for name in names:
+            csv_path = tmp_path / f"{name}.csv"
+            csv_path.write_text(f"column\n{name} value\n")
+            csv_files.append(str(csv_path))
+        return csv_files
+
+    def test_new_spreadsheet(self, tmp_path):
+        """Test that sheets and values are written with one request each"""
+        gspread_client, spreadsheet = self.make_client_with_spreadsheet(
+            ["Sheet1"]
+        )
+        csv_files = self.make_csvs(tmp_path, ["first", "second"])
+
+        gspread_client.upload_csvs_to_spreadsheet(None, csv_files)
+
+        spreadsheet.batch_update.assert_called_once()
+        sheet_requests = spreadsheet.batch_update.call_args[0][0]["requests"]
+        assert [
+            request["addSheet"]["properties"]["title"]
+            for request in sheet_requests[:2]
+        ] == ["first", "second"]
+        assert sheet_requests[2] == {"deleteSheet": {"sheetId": 0}}
+
+        spreadsheet.values_batch_update.assert_called_once()
+        data = spreadsheet.values_batch_update.call_args[1]["body"]["data"]
+        assert data == [
+            {"range": "first", "values": [["column"], ["first value"]]},
+            {"range": "second", "values": [["column"], ["second value"]]},
+        ]
+        spreadsheet.values_update.assert_not_called()
+
+    def test_csvs_are_locked_during_upload(self, tmp_path):
+        """Test that csv locks are held until the batch request returns"""
+        gspread_client, spreadsheet = self.make_client_with_spreadsheet(
+            ["first", "second"]
+        )
+        csv_files = self.make_csvs(tmp_path, ["first", "second"])
+        locked_during_upload = []
+        spreadsheet.values_batch_update.side_effect = (
+            lambda **kwargs: locked_during_upload.extend(
+                make_file_lock(csv_file).is_locked for csv_file in csv_files
+            )
+        )
+
+        gspread_client.upload_csvs_to_spreadsheet(
+            "https://docs.google.com/spreadsheets/d/some_id", csv_files
+        )
+
+        assert locked_during_upload == [True, True]
+        assert not any(
+            make_file_lock(csv_file).is_locked for csv_file in csv_files
+        )
+
+    def test_single_rows_of_existing_worksheets(self, tmp_path):
+        """Test that existing worksheets are not recreated"""
+        gspread_client, spreadsheet = self.make_client_with_spreadsheet(
+            ["first", "second"]
+        )
+        csv_files = self.make_csvs(tmp_path, ["first", "second"])
+
+        gspread_client.upload_csvs_to_spreadsheet(
+            "https://docs.google.com/spreadsheets/d/some_id",
+            csv_files,
+            worksheet_names=["first", "second"],
+            single_rows_per_csv=[1, [0, 1]],
+        )
+
+        spreadsheet.batch_update.assert_not_called()
+        data = spreadsheet.values_batch_update.call_args[1]["body"]["data"]
+        assert data == [
+            {"range": "first!2:2", "values": [["first value"]]},
+            {"range": "second!1:1", "values": [["column"]]},
+            {"range": "second!2:2", "values": [["second value"]]},
+        ]
+
+    def test_download(self, tmp_path):
+        """Test that all worksheets are fetched with one request"""
+        gspread_client, spreadsheet = self.make_client_with_spreadsheet(
+            ["first", "it's second"]
+        )
+        spreadsheet.values_batch_get.return_value = {
+            "valueRanges": [
+                {"values": [["a", "b"], ["1"], ["2", "3"]]},
+                {"values": [["c"], ["4,5"]]},
+            ]
+        }
+
+        csv_paths = gspread_client.download_spreadsheet_as_csv(
+            "https://docs.google.com/spreadsheets/d/some_id", str(tmp_path)
+        )
+
+        spreadsheet.values_batch_get.assert_called_once_with(
+            ranges=["'first'", "'it''s second'"]
+        )
+        assert csv_paths == [
+            str(tmp_path / "first.csv"),
+            str(tmp_path / "it's second.csv"),
+        ]
+        assert (tmp_path / "first.csv").read_text() == "a,b\n1,\n2,3\n"
+        assert (tmp_path / "it's second.csv").read_text() == 'c\n"4,5"\n'
+
+    def test_worksheets_are_cached(self, tmp_path):
+        """Test that worksheets are listed once until a request fails"""
+        gspread_client, spreadsheet = self.make_client_with_spreadsheet(
+            ["first"]
+        )
+        spreadsheet.values_batch_get.return_value = {
+            "valueRanges": [{"values": [["a"]]}]
+        }
+        url = "https://docs.google.com/spreadsheets/d/some_id"
+
+        gspread_client.download_spreadsheet_as_csv(url, str(tmp_path))
+        gspread_client.download_spreadsheet_as_csv(url, str(tmp_path))
+        assert spreadsheet.worksheets.call_count == 1
+
+        spreadsheet.values_batch_get.side_effect = Exception("Failed")
+        with pytest.raises(Exception, match="Failed"):
+            gspread_client.download_spreadsheet_as_csv(url, str(tmp_path))
+        assert gspread_client.worksheets_cache == {}
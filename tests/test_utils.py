@@ -0,0 +1,818 @@
+import pytest
+import csv
+import gc
+import sys
+import os
+from filelock import Timeout
+
+# Add the project root to the path so we can import the modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from stnd.utility.utils import (
+    FILE_LOCKS,
+    AttrDict,
+    ChildrenForPicklingPreparer,
+    add_custom_properties,
+    append_dict,
+    apply_pairwise,
+    bootstrap_by_key_subname,
+    check_duplicates,
+    coefficients_for_bases,
+    compute_file_hash,
+    count_rows_in_file,
+    decode_val_from_str,
+    expand_csv,
+    extract_list_from_huge_string,
+    find_by_subkey,
+    get_nested_attr,
+    get_leaves_of_nested_dict,
+    get_with_assert,
+    has_nested_attr,
+    invert_dict,
+    iter_split,
+    make_file_lock,
+    normalize_path,
+    range_for_each_group,
+    read_csv_as_dict,
+    read_csv_as_dict_pd,
+    read_yaml,
+    remove_all_but_subdirs,
+    replace_many_by_one,
+    run_cmd_through_popen,
+    save_as_yaml,
+    str_is_number,
+    write_csv_dict_to_csv,
+    write_into_csv_in_batch,
+    write_into_csv_pd,
+    write_into_csv_with_column_names,
+)
+
+
+class TestAttrDict:
+    """Test AttrDict class"""
+
+    def test_deepcopy(self):
+        """Test that deepcopy copies nested AttrDicts and self-references"""
+        import copy
+
+        attr_dict = AttrDict({"a": {"b": [1, 2]}})
+        attr_dict.self = attr_dict
+        copied = copy.deepcopy(attr_dict)
+
+        assert isinstance(copied, AttrDict) and isinstance(copied.a, AttrDict)
+        assert copied.a.b == [1, 2] and copied.a.b is not attr_dict.a.b
+        assert copied.self is copied
+
+
+class TestNestedAttr:
+    """Test has_nested_attr and get_nested_attr functions"""
+
+    def test_dicts_and_objects(self):
+        """Test lookups through both dict keys and object attributes"""
+        import types
+
+        nested = {"a": types.SimpleNamespace(b={"c": 1})}
+        assert get_nested_attr(nested, ["a", "b", "c"]) == 1
+        assert get_nested_attr(nested, ["a", "b"]) is nested["a"].b
+        assert has_nested_attr(nested, ["a", "b", "c"])
+        assert not has_nested_attr(nested, ["a", "b", "d"])
+        assert not has_nested_attr(nested, ["a", "x"])
+        assert not has_nested_attr(nested, ["items"])
+
+
+class TestAddCustomProperties:
+    """Test add_custom_properties function"""
+
+    def test_only_missing_properties_are_added(self):
+        """Test that the taker gets the giver's attributes it lacks"""
+        import types
+
+        giver = types.SimpleNamespace(a=1, b=2)
+        taker = types.SimpleNamespace(b=3)
+        add_custom_properties(giver, taker)
+        assert vars(taker) == {"b": 3, "a": 1}
+
+        taker = types.SimpleNamespace()
+        add_custom_properties(giver, taker, only_local=False)
+        assert vars(taker) == {"a": 1, "b": 2}
+
+
+class TestGetWithAssert:
+    """Test get_with_assert function"""
+
+    def test_nested_keys(self):
+        """Test that nested keys are resolved and missing ones reported"""
+        config = {"a": {"b": {"c": None}}, "d": 0}
+        assert get_with_assert(config, "d") == 0
+        assert get_with_assert(config, ["a", "b", "c"]) is None
+        with pytest.raises(Exception, match='Key "x" not in container'):
+            get_with_assert(config, ["a", "x"])
+        with pytest.raises(Exception, match="custom message"):
+            get_with_assert(config, "x", error_msg="custom message")
+
+
+class TestChildrenForPicklingPreparer:
+    """Test ChildrenForPicklingPreparer class"""
+
+    def test_instance_attributes_are_prepared(self):
+        """Test that children stored in instance attributes are prepared"""
+
+        class Child:
+            def __init__(self):
+                self.calls = []
+
+            def _prepare_for_pickling(self):
+                self.calls.append("pickling")
+
+            def _prepare_for_unpickling(self):
+                self.calls.append("unpickling")
+
+        class Parent(ChildrenForPicklingPreparer):
+            class_child = Child()
+
+            def __init__(self):
+                self.child = Child()
+
+        parent = Parent()
+        parent._prepare_for_pickling()
+        parent._prepare_for_unpickling()
+        assert parent.child.calls == ["pickling", "unpickling"]
+        assert Parent.class_child.calls == ["pickling", "unpickling"]
+
+    def test_children_behind_getattr_are_prepared(self):
+        """Test that children reachable only via __getattr__ are prepared"""
+
+        class Child:
+            def __init__(self):
+                self.calls = []
+
+            def _prepare_for_pickling(self):
+                self.calls.append("pickling")
+
+            def _prepare_for_unpickling(self):
+                self.calls.append("unpickling")
+
+        class ModuleLikeParent(ChildrenForPicklingPreparer):
+            def __init__(self):
+                self._modules = {"child": Child()}
+
+            def __getattr__(self, name):
+                modules = self.__dict__["_modules"]
+                if name in modules:
+                    return modules[name]
+                raise AttributeError(name)
+
+            def __dir__(self):
+                return list(super().__dir__()) + list(self._modules)
+
+        parent = ModuleLikeParent()
+        parent._prepare_for_pickling()
+        parent._prepare_for_unpickling()
+        assert parent.child.calls == ["pickling", "unpickling"]
+
+
+class TestReadYaml:
+    """Test read_yaml and save_as_yaml functions"""
+
+    def test_round_trip(self, tmp_path):
+        """Test that a saved config is read back unchanged"""
+        config = {
+            "experiment_name": "test",
+            "params": {"lr": 0.1, "layers": [1, 2], "flag": True},
+            "empty": None,
+        }
+        yaml_path = str(tmp_path / "config.yaml")
+        save_as_yaml(yaml_path, config)
+        assert read_yaml(yaml_path) == config
+
+
+class TestRemoveAllButSubdirs:
+    """Test remove_all_but_subdirs function"""
+
+    def test_only_kept_objects_remain(self, tmp_path):
+        """Test that files and folders not to keep are removed"""
+        for folder_name in ["keep_folder", "remove_folder"]:
+            (tmp_path / folder_name).mkdir()
+            (tmp_path / folder_name / "file.txt").write_text("content")
+        for file_name in ["keep.txt", "remove.txt"]:
+            (tmp_path / file_name).write_text("content")
+
+        remove_all_but_subdirs(str(tmp_path), ["keep_folder", "keep.txt"])
+        assert sorted(path.name for path in tmp_path.iterdir()) == [
+            "keep.txt",
+            "keep_folder",
+        ]
+        assert (tmp_path / "keep_folder" / "file.txt").exists()
+
+
+class TestNormalizePath:
+    """Test normalize_path function"""
+
+    def test_env_vars_are_substituted(self, monkeypatch):
+        """Test that every <$VAR> in the path is replaced by its value"""
+        monkeypatch.setenv("STND_TEST_ROOT", "/some/root")
+        monkeypatch.setenv("STND_TEST_NAME", "name")
+        monkeypatch.setenv("PROJECT_ROOT_PROVIDED_FOR_STUNED", "/project")
+        assert normalize_path(
+            "<$STND_TEST_ROOT>/<$STND_TEST_NAME>/<$STND_TEST_NAME>.csv"
+        ) == os.path.abspath("/some/root/name/name.csv")
+        assert normalize_path(
+            ["./relative", "/absolute"], current_dir="/current"
+        ) == ["/current/relative", "/absolute"]
+
+    def test_unset_env_var(self, monkeypatch):
+        """Test that unset environment variables are reported"""
+        monkeypatch.delenv("STND_TEST_UNSET", raising=False)
+        monkeypatch.setenv("PROJECT_ROOT_PROVIDED_FOR_STUNED", "/project")
+        with pytest.raises(AssertionError, match="STND_TEST_UNSET"):
+            normalize_path("<$STND_TEST_UNSET>/file")
+
+
+class TestCheckDuplicates:
+    """Test check_duplicates function"""
+
+    def test_duplicates_are_reported(self):
+        """Test that only lists with duplicates raise, naming the duplicates"""
+        check_duplicates(["a", "b", "c"])
+        check_duplicates([])
+        with pytest.raises(Exception, match="'b': 2"):
+            check_duplicates(["a", "b", "b"])
+
+
+class TestMakeFileLock:
+    """Test make_file_lock function"""
+
+    def test_lock_is_shared_within_process(self, tmp_path):
+        """Test that the same lock object is returned for the same file"""
+        file_name = str(tmp_path / "file.csv")
+        assert make_file_lock(file_name) is make_file_lock(file_name)
+
+    def test_unused_locks_are_dropped(self, tmp_path):
+        """Test that the lock cache does not keep unreferenced locks"""
+        file_name = str(tmp_path / "file.csv")
+        lock_key = (os.getpid(), os.path.abspath(file_name + ".lock"))
+        file_lock = make_file_lock(file_name)
+        assert FILE_LOCKS[lock_key] is file_lock
+
+        del file_lock
+        gc.collect()
+        assert lock_key not in FILE_LOCKS
+
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="Requires os.fork")
+    def test_parent_locks_are_dropped_in_forked_child(self, tmp_path):
+        """Test that a child drops cached locks of its parent"""
+        file_name = str(tmp_path / "file.csv")
+        parent_lock = make_file_lock(file_name)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                make_file_lock(str(tmp_path / "other.csv"))
+                parent_pid = os.getppid()
+                stale = [
+                    key for key in FILE_LOCKS.keys() if key[0] == parent_pid
+                ]
+                os._exit(1 if stale else 0)
+            except BaseException:
+                os._exit(2)
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0
+        assert make_file_lock(file_name) is parent_lock
+
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="Requires os.fork")
+    def test_lock_is_not_inherited_by_forked_child(self, tmp_path):
+        """Test that a child does not reuse a lock held by its parent"""
+        file_name = str(tmp_path / "file.csv")
+        with make_file_lock(file_name):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    make_file_lock(file_name).acquire(timeout=0)
+                    os._exit(1)
+                except Timeout:
+                    os._exit(0)
+                except BaseException:
+                    os._exit(2)
+            _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0
+
+
+class TestIterSplit:
+    """Test iter_split function"""
+
+    @pytest.mark.parametrize(
+        "input_string,separator",
+        [
+            ("", " "),
+            ("word", " "),
+            (" leading and  double spaces ", " "),
+            ("a--b----c--", "--"),
+            ("--", "--"),
+        ],
+    )
+    def test_matches_str_split(self, input_string, separator):
+        """Test that iter_split yields the same parts as str.split"""
+        assert list(iter_split(input_string, separator)) == input_string.split(
+            separator
+        )
+
+    def test_empty_separator(self):
+        """Test that an empty separator is rejected like in str.split"""
+        with pytest.raises(ValueError, match="empty separator"):
+            iter_split("abc", "")
+
+
+class TestExtractListFromHugeString:
+    """Test extract_list_from_huge_string function"""
+
+    def test_parts_are_stripped(self):
+        """Test that parts are stripped and empty ones are dropped"""
+        assert extract_list_from_huge_string(" a \n\n b\n  \nc") == [
+            "a",
+            "b",
+            "c",
+        ]
+        assert extract_list_from_huge_string("a, b,", separator=",") == [
+            "a",
+            "b",
+        ]
+
+
+class TestApplyPairwise:
+    """Test apply_pairwise function"""
+
+    def test_vectorized_matches_python(self):
+        """Test that the vectorized call gives the same pairs in order"""
+        import numpy as np
+
+        values = [1.0, 4.0, 2.0, 8.0]
+        expected = apply_pairwise(values, lambda a, b: abs(a - b))
+        assert expected == [3.0, 1.0, 7.0, 2.0, 4.0, 6.0]
+        assert (
+            apply_pairwise(values, lambda a, b: np.abs(a - b), vectorized=True)
+            == expected
+        )
+
+        vectors = [[0, 0], [3, 4], [6, 8]]
+        assert apply_pairwise(
+            vectors,
+            lambda a, b: np.linalg.norm(a - b, axis=-1),
+            vectorized=True,
+        ) == [5.0, 10.0, 5.0]
+
+
+class TestRunCmdThroughPopen:
+    """Test run_cmd_through_popen function"""
+
+    def test_output_reaches_buffer_processor(self, capsys):
+        """Test that whole lines are passed on and newlines are translated"""
+        buffers = []
+        run_cmd_through_popen(
+            "printf 'first\\r\\nvalue=1\\nlast'; echo error >&2",
+            None,
+            stdout_buffer_processor=buffers.append,
+        )
+        assert "first\nvalue=1\n" in buffers[-1]
+        assert buffers[-1].endswith("\nlast")
+        assert "error" in capsys.readouterr().err
+
+    def test_failed_process(self):
+        """Test that a non-zero return code raises an exception"""
+        with pytest.raises(Exception, match="return code: 3"):
+            run_cmd_through_popen("exit 3", None)
+
+
+class TestRangeForEachGroup:
+    """Test range_for_each_group function"""
+
+    def test_ranges_cover_all_elements(self):
+        """Test that ranges are contiguous and differ in size by at most 1"""
+        assert range_for_each_group(3, 10) == [(0, 4), (4, 7), (7, 10)]
+        assert range_for_each_group(2, 2) == [(0, 1), (1, 2)]
+
+
+class TestCoefficientsForBases:
+    """Test coefficients_for_bases function"""
+
+    def test_decomposition(self):
+        """Test that a number is decomposed greedily into bases"""
+        assert coefficients_for_bases(38, [10, 5, 1]) == [3, 1, 3]
+        assert coefficients_for_bases(10**20 + 1, [10**20, 1]) == [1, 1]
+
+
+class TestCountRowsInFile:
+    """Test count_rows_in_file function"""
+
+    @pytest.mark.parametrize(
+        "contents",
+        [
+            "",
+            "a\n",
+            "a\nb",
+            "a\n\nb\n",
+            "a\r\nb\r\n",
+            "a\rb\r",
+            "a\rb",
+            "a\r\n\rb\r\r\n",
+        ],
+    )
+    @pytest.mark.parametrize("chunk_size", [1, 2, 1 << 20])
+    def test_matches_line_iteration(
+        self, tmp_path, monkeypatch, contents, chunk_size
+    ):
+        """Test that rows are counted as iterating over the file would"""
+        monkeypatch.setattr(
+            "stnd.utility.utils.DEFAULT_FILE_CHUNK_SIZE", chunk_size
+        )
+        file_path = tmp_path / "file.csv"
+        file_path.write_bytes(contents.encode())
+        with open(file_path, newline="") as file:
+            expected_rowcount = len(file.readlines())
+            assert count_rows_in_file(file) == expected_rowcount
+            assert file.read() == contents
+        with open(file_path, "rb") as file:
+            assert count_rows_in_file(file) == expected_rowcount
+
+
+class TestComputeFileHash:
+    """Test compute_file_hash function"""
+
+    def test_md5(self, tmp_path):
+        """Test that md5 of a file matches hashlib"""
+        import hashlib
+
+        file_path = tmp_path / "file.bin"
+        file_path.write_bytes(b"some content" * 1000)
+        assert (
+            compute_file_hash(str(file_path), chunksize=7)
+            == hashlib.md5(file_path.read_bytes()).hexdigest()
+        )
+
+    def test_mmaped_file(self, tmp_path, monkeypatch):
+        """Test that large files hashed through mmap give the same hash"""
+        import hashlib
+
+        monkeypatch.setattr(
+            "stnd.utility.utils.MIN_FILE_SIZE_TO_HASH_MMAPED", 1000
+        )
+        file_path = tmp_path / "file.bin"
+        file_path.write_bytes(b"some content" * 1000)
+        assert (
+            compute_file_hash(str(file_path))
+            == hashlib.md5(file_path.read_bytes()).hexdigest()
+        )
+
+    def test_blake3(self, tmp_path):
+        """Test that blake3 hash type uses the optional blake3 package"""
+        blake3 = pytest.importorskip("blake3")
+
+        file_path = tmp_path / "file.bin"
+        file_path.write_bytes(b"some content" * 1000)
+        assert (
+            compute_file_hash(str(file_path), hash_type="blake3")
+            == blake3.blake3(file_path.read_bytes()).hexdigest()
+        )
+
+
+class TestStrIsNumber:
+    """Test str_is_number function"""
+
+    @pytest.mark.parametrize(
+        "input_str",
+        ["0", "-12", "1.5", ".5", "1.", "1e5", "1E-5", "-1.5e+10", "1e5.5"],
+    )
+    def test_numbers(self, input_str):
+        """Test that numbers are recognized"""
+        assert str_is_number(input_str)
+
+    @pytest.mark.parametrize(
+        "input_str",
+        ["", "a", "1-", "--1", "1.2.3", "1e", "1e+", "1e5e5", "1e+-5", " 1"],
+    )
+    def test_not_numbers(self, input_str):
+        """Test that other strings are not recognized as numbers"""
+        assert not str_is_number(input_str)
+
+
+class TestReplaceManyByOne:
+    """Test replace_many_by_one function"""
+
+    def test_replaces_in_one_pass(self):
+        """Test that longer items win and replacements are not rescanned"""
+        assert replace_many_by_one("a, b,c", [" ", ", ", ","], " ") == "a b c"
+        assert replace_many_by_one("ab", ["a", "b"], "b") == "bb"
+        assert replace_many_by_one("a.b", ["."], "\\") == "a\\b"
+
+
+class TestDecodeValFromStr:
+    """Test decode_val_from_str function"""
+
+    @pytest.mark.parametrize(
+        "value,expected",
+        [
+            ("[1, 2]", [1, 2]),
+            ("[1,2]", [1, 2]),
+            ("[a  b]", ["a", "b"]),
+            ("[]", []),
+            ("1.5", 1.5),
+            ("None", None),
+            ("NULL", None),
+            ("false", False),
+            ("TRUE", True),
+            ("tRue", "tRue"),
+        ],
+    )
+    def test_values(self, value, expected):
+        """Test that numbers and lists with any separators are decoded"""
+        assert decode_val_from_str(value) == expected
+
+
+class TestAppendDict:
+    """Test append_dict function"""
+
+    def test_leaves_are_appended(self):
+        """Test that leaves are collected into lists of the nested dict"""
+        total_dict = {}
+        append_dict(total_dict, {"a": 1, "b": {"c": 2}})
+        append_dict(total_dict, {"a": 3, "b": {"c": 4}})
+        assert total_dict == {"a": [1, 3], "b": {"c": [2, 4]}}
+
+        append_dict(total_dict, {"b": {"d": 5}}, allow_new_keys=True)
+        assert total_dict == {"a": [1, 3], "b": {"c": [2, 4], "d": [5]}}
+
+        with pytest.raises(AssertionError):
+            append_dict(total_dict, {"e": 6})
+
+
+class TestBootstrapByKeySubname:
+    """Test bootstrap_by_key_subname function"""
+
+    def test_docstring_example(self):
+        """Test that values are lifted from leaves to root"""
+        input_dict = {
+            "a": 1,
+            "b": {"csubkeyd": {"e": 2, "gsubkeyh": 3}, "f": 4},
+            "c": {"subkey": {"i": 5}, "other_subkey": 6},
+        }
+        bootstrap_by_key_subname(input_dict, "subkey")
+        assert input_dict == {"a": 1, "b": 3, "c": {"i": 5}}
+
+
+class TestFindBySubkey:
+    """Test find_by_subkey function"""
+
+    def test_first_and_all_occurences(self):
+        """Test that the first or all keys containing the subkey are found"""
+        keys = [1, "a_key", "b", "another_key"]
+        assert find_by_subkey(keys, "key") == "a_key"
+        assert find_by_subkey(keys, "key", only_first_occurence=False) == [
+            "a_key",
+            "another_key",
+        ]
+        assert find_by_subkey(keys, "missing") is None
+        with pytest.raises(AssertionError):
+            find_by_subkey(
+                keys, "missing", assert_found=True, only_first_occurence=False
+            )
+
+
+class TestInvertDict:
+    """Test invert_dict function"""
+
+    def test_invert(self):
+        """Test that values of containers become keys"""
+        assert invert_dict({"a": [1, 2], "b": (3, None)}) == {
+            1: "a",
+            2: "a",
+            3: "b",
+            None: "b",
+        }
+        assert invert_dict({"a": [None]}, none_to_string=True) == {"None": "a"}
+        with pytest.raises(AssertionError, match="not invertible"):
+            invert_dict({"a": [1], "b": [1]})
+
+
+class TestGetLeavesOfNestedDict:
+    """Test get_leaves_of_nested_dict function"""
+
+    NESTED_DICT = {"a": 1, "b": {"c": {"d": 2}, "e": 3}, "f": 4}
+
+    def test_leaves_in_depth_first_order(self):
+        """Test that leaves are listed in depth-first insertion order"""
+        assert get_leaves_of_nested_dict(self.NESTED_DICT) == [
+            ["a"],
+            ["b", "c", "d"],
+            ["b", "e"],
+            ["f"],
+        ]
+
+    def test_include_values_and_prefix(self):
+        """Test that values and the key prefix are included"""
+        assert get_leaves_of_nested_dict(
+            self.NESTED_DICT["b"], nested_key_prefix=["b"], include_values=True
+        ) == [(["b", "c", "d"], 2), (["b", "e"], 3)]
+
+    def test_empty_dict(self):
+        """Test that empty nested dicts raise unless allowed"""
+        nested_dict = {"a": {}, "b": 1}
+        with pytest.raises(ValueError, match="Nested dict is empty"):
+            get_leaves_of_nested_dict(nested_dict)
+        assert get_leaves_of_nested_dict(
+            nested_dict, allow_empty_dict=True
+        ) == [["b"]]
+        assert get_leaves_of_nested_dict({}, allow_empty_dict=True) == []
+
+
+class TestReadCsvAsDict:
+    """Test read_csv_as_dict function"""
+
+    def test_row_numbers(self, tmp_path):
+        """Test that only the header and the requested rows are read"""
+        csv_path = tmp_path / "file.csv"
+        csv_path.write_text("a,b\n1,2\n3,4\n5,6\n")
+        full_dict = read_csv_as_dict(str(csv_path))
+        assert len(full_dict) == 4
+
+        assert read_csv_as_dict(str(csv_path), row_numbers=[2]) == {
+            0: full_dict[0],
+            2: full_dict[2],
+        }
+        assert read_csv_as_dict(str(csv_path), row_numbers=[0]) == {
+            0: full_dict[0]
+        }
+
+    def test_matches_dict_reader(self, tmp_path):
+        """Test that rows are the same as the ones from csv.DictReader"""
+        csv_path = tmp_path / "file.csv"
+        csv_path.write_text("a,b,c\n1,2,3\n\n4,5\n6,7,8,9\n")
+        with open(csv_path, newline="") as csv_file:
+            expected_rows = list(
+                csv.DictReader(
+                    csv_file, quoting=csv.QUOTE_NONE, escapechar="\\"
+                )
+            )
+
+        result = read_csv_as_dict(str(csv_path))
+        assert result[0] == {"a": "a", "b": "b", "c": "c"}
+        assert [result[i] for i in range(1, len(result))] == expected_rows
+        assert result[2] == {"a": "4", "b": "5", "c": None}
+        assert result[3][None] == ["9"]
+
+    def test_pd_version(self, tmp_path):
+        """Test that the pandas version keeps the same row numbering"""
+        pytest.importorskip("pandas")
+        csv_path = tmp_path / "file.csv"
+        csv_path.write_text("a,b\n1,x\n2,y\n")
+        assert read_csv_as_dict_pd(str(csv_path)) == {
+            0: {"a": "a", "b": "b"},
+            1: {"a": 1, "b": "x"},
+            2: {"a": 2, "b": "y"},
+        }
+
+
+class TestWriteIntoCsvInBatch:
+    """Test write_into_csv_in_batch function"""
+
+    TRIPLETS = [
+        (1, "status", "Running"),
+        (2, "new column", "value"),
+        (1, "status", "Completed"),
+        (0, "another column", "renamed column"),
+    ]
+
+    @pytest.mark.parametrize(
+        "initial_contents",
+        ["name,status\nfirst,?\nsecond,?\n", ""],
+    )
+    def test_matches_sequential_writes(self, tmp_path, initial_contents):
+        """Test that a batch gives the same file as one write per triplet"""
+        batch_path = tmp_path / "batch.csv"
+        sequential_path = tmp_path / "sequential.csv"
+        batch_path.write_text(initial_contents)
+        sequential_path.write_text(initial_contents)
+        triplets = self.TRIPLETS if initial_contents else self.TRIPLETS[:1]
+
+        write_into_csv_in_batch(str(batch_path), triplets)
+        for row_number, column_name, value in triplets:
+            write_into_csv_with_column_names(
+                str(sequential_path), row_number, column_name, value
+            )
+
+        assert batch_path.read_text() == sequential_path.read_text()
+        assert sorted(path.name for path in tmp_path.iterdir()) == [
+            "batch.csv",
+            "batch.csv.lock",
+            "sequential.csv",
+            "sequential.csv.lock",
+        ]
+
+    def test_missing_row_leaves_file_untouched(self, tmp_path):
+        """Test that no triplet is written when one of them is invalid"""
+        csv_path = tmp_path / "output.csv"
+        csv_path.write_text("name,status\nfirst,?\n")
+        contents = csv_path.read_text()
+
+        with pytest.raises(Exception, match="insertion into row 5"):
+            write_into_csv_in_batch(
+                str(csv_path), [(1, "status", "Running"), (5, "status", "?")]
+            )
+
+        assert csv_path.read_text() == contents
+
+
+class TestWriteCsvDictToCsv:
+    """Test write_csv_dict_to_csv function"""
+
+    def test_matches_writes_per_cell(self, tmp_path):
+        """Test that the file is the same as after one write per cell"""
+        dict_from_csv = {
+            0: {"name": "name", "value": "value"},
+            1: {"name": "first", "value": 1},
+            2: {"name": "second", "value": None, "extra": "x"},
+            3: {"name": "third", "value": "a,b"},
+        }
+        csv_path = tmp_path / "dict.csv"
+        csv_path.write_text("old contents\n")
+        per_cell_path = tmp_path / "per_cell.csv"
+        per_cell_path.touch()
+
+        write_csv_dict_to_csv(dict_from_csv, str(csv_path))
+        for row_number, row_as_dict in list(dict_from_csv.items())[1:]:
+            for i, (column_name, value) in enumerate(row_as_dict.items()):
+                write_into_csv_with_column_names(
+                    str(per_cell_path),
+                    row_number,
+                    column_name,
+                    value,
+                    append_row=(i == 0),
+                )
+
+        assert csv_path.read_text() == per_cell_path.read_text()
+        assert read_csv_as_dict(str(csv_path))[2] == {
+            "name": "second",
+            "value": "",
+            "extra": "x",
+        }
+
+
+class TestExpandCsv:
+    """Test expand_csv function"""
+
+    def test_cross_product_and_ranges(self, tmp_path):
+        """Test that lists and ranges are expanded into a cross product"""
+        csv_path = tmp_path / "to_expand.csv"
+        csv_path.write_text("a,b,c\n{1 | 2},{x | y},plain\n{<1 10 2 1>},z,\n")
+        expanded_path = tmp_path / "expanded.csv"
+
+        expand_csv(str(csv_path), str(expanded_path))
+        assert expanded_path.read_text() == (
+            "a,b,c\n"
+            "1,x,plain\n"
+            "1,y,plain\n"
+            "2,x,plain\n"
+            "2,y,plain\n"
+            "1,z,\n"
+            "2,z,\n"
+            "4,z,\n"
+            "8,z,\n"
+        )
+
+    def test_linear_float_range(self, tmp_path):
+        """Test that float steps do not accumulate rounding errors"""
+        csv_path = tmp_path / "to_expand.csv"
+        csv_path.write_text("a\n{<0.1 1 0.1 0>}\n")
+        expanded_path = tmp_path / "expanded.csv"
+
+        expand_csv(str(csv_path), str(expanded_path))
+        values = [
+            row["a"]
+            for row in list(read_csv_as_dict(str(expanded_path)).values())[1:]
+        ]
+        assert len(values) == 9
+        assert float(values[-1]) == pytest.approx(0.9)
+
+
+class TestWriteIntoCsvPd:
+    """Test write_into_csv_pd function"""
+
+    def test_creates_file_rows_and_columns(self, tmp_path):
+        """Test that missing file, rows and columns are created"""
+        csv_path = str(tmp_path / "new.csv")
+
+        write_into_csv_pd(csv_path, 2, "a", "x", allow_creating_file=True)
+        write_into_csv_pd(csv_path, 1, "b", 0.5)
+
+        assert (tmp_path / "new.csv").read_text() == "a,b\n,0.5\nx,\n"
+
+    def test_keeps_values_as_strings(self, tmp_path):
+        """Test that other cells are not reformatted"""
+        csv_path = tmp_path / "file.csv"
+        csv_path.write_text('a,b\n007,"1,5"\n')
+
+        write_into_csv_pd(str(csv_path), 1, "b", None)
+
+        assert csv_path.read_text() == "a,b\n007,\n"
+
+    def test_missing_file(self, tmp_path):
+        """Test that missing file is not created by default"""
+        with pytest.raises(FileNotFoundError):
+            write_into_csv_pd(str(tmp_path / "missing.csv"), 1, "a", "x")